@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import pandas
+
+from ngsatdata.base.errors import *
+
+# -------- GLOBAL VARIABLES -------- #
+epoch = datetime(1970, 1, 1)
+# the earliest and the latest second an interval may cover
+min_second = -(2 ** 62)
+max_second = 2 ** 62
+# the seconds of datetime.min and datetime.max
+first_second = int((datetime.min - epoch) // timedelta(seconds=1))
+last_second = int((datetime.max - epoch) // timedelta(seconds=1))
+# -------- END OF GLOBAL VARIABLES -------- #
+
+
+def to_seconds(value):
+    """Converting a datetime or a datetime string to integer seconds since the epoch"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        value = pandas.Timestamp(value).to_pydatetime().replace(tzinfo=None)
+    except (ValueError, TypeError):
+        raise DatetimeValueError('Invalid datetime value: %s' % (value,))
+    return int((value - epoch) // timedelta(seconds=1))
+
+
+def from_seconds(value):
+    """Converting seconds since the epoch to a datetime. Values beyond the datetime range become datetime.min/max"""
+    if value <= first_second:
+        return datetime.min
+    if value >= last_second:
+        return datetime.max.replace(microsecond=0)
+    return epoch + timedelta(seconds=value)
+
+
+def add_interval(intervals, start, end):
+    """Adding the inclusive interval [start, end] to a sorted list of disjoint intervals, merging neighbours"""
+    return merge_intervals(list(intervals) + [[start, end]])
+
+
+def remove_interval(intervals, start, end):
+    """Removing the inclusive interval [start, end] from a sorted list of disjoint intervals"""
+    return subtract_intervals(intervals, [[start, end]])
+
+
+def merge_intervals(intervals):
+    """Sorting inclusive [start, end] intervals and merging the overlapping and neighbouring ones"""
+    out = []
+    for lo, hi in sorted(intervals):
+        if out and lo <= out[-1][1] + 1:
+            out[-1][1] = max(out[-1][1], hi)
+        else:
+            out.append([lo, hi])
+    return out
+
+
+def subtract_intervals(intervals, removed):
+    """Removing the sorted disjoint intervals removed from the sorted disjoint intervals in one linear pass"""
+    out = []
+    j = 0
+    for lo, hi in intervals:
+        # the removed intervals that end before this one cannot touch the following ones either
+        while j < len(removed) and removed[j][1] < lo:
+            j += 1
+        k = j
+        while k < len(removed) and removed[k][0] <= hi:
+            r_lo, r_hi = removed[k]
+            if r_lo > lo:
+                out.append([lo, r_lo - 1])
+            lo = max(lo, r_hi + 1)
+            k += 1
+        if lo <= hi:
+            out.append([lo, hi])
+    return out
+
+
+class CoverageIndex(object):
+    """A per-channel index of time intervals known to hold data and known to be empty
+
+    The intervals are inclusive and kept in whole seconds. Marking an interval as present removes it from
+    the empty ones and vice versa, so the latest observation wins. The last `recent` of time before now is
+    never marked as empty, since the provider may still be ingesting it. With a path, the index is loaded from
+    and saved to a JSON file after every change.
+
+    Attributes:
+        path (str): The JSON file of the index, or None to keep it in memory.
+        recent (timedelta): How long before now a response without data is not trusted to stay empty.
+
+    Usage example:
+        from ngsatdata.base.coverage import CoverageIndex
+        from ngsatdata.providers.smdc import SMDC
+        smdc = SMDC(coverage=CoverageIndex('smdc_coverage.json'))
+        smdc.authorize()
+        # the second fetch of an interval without data is answered locally
+        df = smdc.fetch(...)
+        # ask the provider again, e.g. after it has been backfilled
+        df = smdc.fetch(..., use_coverage=False)
+    """
+
+    def __init__(self, path: str = None, recent: timedelta = timedelta(days=1)):
+        self.path = path
+        self.recent = recent
+        self._lock = threading.RLock()
+        self._index: Dict = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self._index = json.load(f)
+
+    def keys(self):
+        return sorted(self._index)
+
+    def present(self, key):
+        """Returning the known-present intervals of a channel as (start, end) datetime pairs"""
+        return [(from_seconds(lo), from_seconds(hi)) for lo, hi in self._intervals(key, 'present')]
+
+    def empty(self, key):
+        """Returning the known-empty intervals of a channel as (start, end) datetime pairs"""
+        return [(from_seconds(lo), from_seconds(hi)) for lo, hi in self._intervals(key, 'empty')]
+
+    def mark_present(self, key, start_dt, end_dt):
+        self._mark(key, 'present', 'empty', [(to_seconds(start_dt), to_seconds(end_dt))])
+
+    def mark_empty(self, key, start_dt, end_dt):
+        self._mark(key, 'empty', 'present', [(to_seconds(start_dt), min(to_seconds(end_dt), self._settled()))])
+
+    def update(self, key, present=(), empty=()):
+        """Marking several intervals at once and saving the index once
+
+        Args:
+          key (str): the channel key
+          present (list): (start, end) pairs of datetimes or seconds since the epoch that hold data
+          empty (list): (start, end) pairs of datetimes or seconds since the epoch without data
+        """
+        settled = self._settled()
+        present = [(to_seconds(start), to_seconds(end)) for start, end in present]
+        empty = [(to_seconds(start), min(to_seconds(end), settled)) for start, end in empty]
+        with self._lock:
+            self._mark(key, 'present', 'empty', present, save=False)
+            self._mark(key, 'empty', 'present', empty, save=False)
+            self.save()
+
+    def forget(self, key=None, start_dt=None, end_dt=None):
+        """Dropping what is known about [start_dt, end_dt] of a channel, or about everything when key is None
+
+        Args:
+          key (str): the channel key, or None for all channels
+          start_dt (datetime or str): the start of the interval, or None for the beginning of time
+          end_dt (datetime or str): the end of the interval, or None for the end of time
+        """
+        start = to_seconds(start_dt) if start_dt is not None else min_second
+        end = to_seconds(end_dt) if end_dt is not None else max_second
+        with self._lock:
+            for k in ([key] if key is not None else list(self._index)):
+                entry = self._index.get(k)
+                if entry is None:
+                    continue
+                for kind in ('present', 'empty'):
+                    entry[kind] = remove_interval(entry[kind], start, end)
+                if not entry['present'] and not entry['empty']:
+                    del self._index[k]
+            self.save()
+
+    def set_bounds(self, key, first_dt=None, last_dt=None):
+        """Marking everything before first_dt and after last_dt as empty, e.g. from the mission dates"""
+        if first_dt is not None:
+            self._mark(key, 'empty', 'present', [(min_second, to_seconds(first_dt) - 1)])
+        if last_dt is not None:
+            self._mark(key, 'empty', 'present', [(to_seconds(last_dt) + 1, max_second)])
+
+    def is_empty(self, key, start_dt, end_dt):
+        """Checking if the whole interval [start_dt, end_dt] is known to be empty"""
+        start, end = to_seconds(start_dt), to_seconds(end_dt)
+        return any(lo <= start and end <= hi for lo, hi in self._intervals(key, 'empty'))
+
+    def plan(self, key, start_dt, end_dt, min_gap: timedelta = None):
+        """Splitting [start_dt, end_dt] into the sub-intervals that are not known to be empty
+
+        Args:
+          key (str): the channel key
+          start_dt (datetime or str): the start of the interval
+          end_dt (datetime or str): the end of the interval
+          min_gap (timedelta): empty intervals that cover less than min_gap of [start_dt, end_dt] are fetched
+            anyway, so short dropouts do not split the interval into many small requests
+
+        Returns:
+          list: (start, end) datetime pairs to fetch
+        """
+        start, end = to_seconds(start_dt), to_seconds(end_dt)
+        min_seconds = int(min_gap.total_seconds()) if min_gap is not None else 0
+        gaps = [[lo, hi] for lo, hi in self._intervals(key, 'empty')
+                if hi >= start and lo <= end and min(hi, end) - max(lo, start) + 1 >= min_seconds]
+        todo = subtract_intervals([[start, end]], gaps)
+        return [(from_seconds(lo), from_seconds(hi)) for lo, hi in todo]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self._index, f)
+            os.replace(tmp, self.path)
+
+    def _settled(self):
+        """Returning the last second that is older than self.recent"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return to_seconds(now - self.recent) - 1
+
+    def _intervals(self, key, kind):
+        with self._lock:
+            return list(self._index.get(key, {}).get(kind, []))
+
+    def _mark(self, key, kind, opposite, intervals, save=True):
+        """Adding (start, end) second pairs to the kind intervals of a channel and removing them from the
+        opposite ones, with one sort and one linear pass per kind
+        """
+        intervals = merge_intervals([start, end] for start, end in intervals if start <= end)
+        if not intervals:
+            return
+        with self._lock:
+            entry = self._index.setdefault(key, {'present': [], 'empty': []})
+            entry[kind] = merge_intervals(entry[kind] + intervals)
+            entry[opposite] = subtract_intervals(entry[opposite], intervals)
+            if save:
+                self.save()
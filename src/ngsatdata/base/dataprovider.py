@@ -7,6 +7,8 @@ from ngsatdata.base.errors import *
 
 http_5xx_codes = [500, 501, 502, 503, 504, 511, 520, 521, 522, 525, 530]
 http_4xx_codes = [400, 401, 403, 405, 408, 421, 422]
+# the codes of a missing or expired session; the other 4xx codes reject the request itself
+http_auth_codes = [401, 403]
 http_2xx_codes = [200, 201, 202]
 
 
@@ -59,6 +61,10 @@ class DataProvider(object):
             r = self.session.get(api_url, headers=headers, params=payload)
             if r.status_code in http_2xx_codes:
                 return r.text
+            elif r.status_code in http_4xx_codes and r.status_code not in http_auth_codes:
+                self.logger.error('Request rejected. URL: %s, method: %s, status: %d' % (
+                    api_url, method, r.status_code))
+                raise RequestRejected('URL: %s, method: %s, status: %d' % (api_url, method, r.status_code))
             elif r.status_code in http_4xx_codes:
                 self.logger.error('Access denied. URL: %s, method: %s, headers: %s, payload: %s' % (
                     api_url,
@@ -67,11 +73,19 @@ class DataProvider(object):
                     payload
                 ))
                 raise AccessDenied('URL: %s, method: %s' % (api_url, method))
+            elif r.status_code == 429 or r.status_code in http_5xx_codes:
+                self.logger.warning('Provider overloaded. URL: %s, method: %s, status: %d' % (
+                    api_url, method, r.status_code))
+                raise ProviderOverloaded('URL: %s, method: %s, status: %d' % (api_url, method, r.status_code))
         elif method == 'POST':
             # print(self.session.cookies)
             r = self.session.post(api_url, headers=headers, data=payload, cookies=self.session.cookies)
             if r.status_code in http_2xx_codes:
                 return r.text
+            elif r.status_code in http_4xx_codes and r.status_code not in http_auth_codes:
+                self.logger.error('Request rejected. URL: %s, method: %s, status: %d' % (
+                    api_url, method, r.status_code))
+                raise RequestRejected('URL: %s, method: %s, status: %d' % (api_url, method, r.status_code))
             elif r.status_code in http_4xx_codes:
                 self.logger.error('Access denied. URL: %s, method: %s, headers: %s, payload: %s' % (
                     api_url,
@@ -80,6 +94,10 @@ class DataProvider(object):
                     payload
                 ))
                 raise AccessDenied('URL: %s, method: %s' % (api_url, method))
+            elif r.status_code == 429 or r.status_code in http_5xx_codes:
+                self.logger.warning('Provider overloaded. URL: %s, method: %s, status: %d' % (
+                    api_url, method, r.status_code))
+                raise ProviderOverloaded('URL: %s, method: %s, status: %d' % (api_url, method, r.status_code))
         else:
             raise MethodNotSupported('URL: %s, method: %s' % (api_url, method))
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+import pandas
+
+from ngsatdata.base.errors import *
+
+downsampling_methods = ['lttb', 'minmax']
+
+
+def lttb_indices(x, y, n_out):
+    """Selecting n_out points that preserve the visual shape of a series (Largest-Triangle-Three-Buckets)
+
+    The first and the last point are always kept. Every other bucket contributes the point that forms the
+    largest triangle with the point selected in the previous bucket and the average of the next bucket.
+
+    Args:
+      x (numpy.ndarray): increasing x values (e.g. timestamps as floats)
+      y (numpy.ndarray): y values without NaN
+      n_out (int): the number of points to keep
+
+    Returns:
+      numpy.ndarray: sorted indices of the kept points
+    """
+    n = len(y)
+    if n_out >= n:
+        return numpy.arange(n)
+    if n_out < 3:
+        raise ArgumentValueError('LTTB needs at least 3 points, got: %d' % n_out)
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+
+    # n_out - 2 buckets over the inner points; every bucket holds at least one point
+    edges = numpy.linspace(1, n - 1, n_out - 1).astype(numpy.int64)
+    counts = numpy.diff(edges)
+    avg_x = numpy.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = numpy.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    next_x = numpy.append(avg_x[1:], x[n - 1])
+    next_y = numpy.append(avg_y[1:], y[n - 1])
+
+    out = numpy.empty(n_out, dtype=numpy.int64)
+    out[0] = a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = numpy.abs((ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay))
+        a = lo + int(numpy.argmax(area))
+        out[i + 1] = a
+    out[-1] = n - 1
+    return out
+
+
+def minmax_indices(y, n_out):
+    """Selecting the minimum and the maximum of n_out // 2 equal buckets, in time order
+
+    When n_out is odd the last point is kept as well, so exactly n_out points are returned.
+
+    Args:
+      y (numpy.ndarray): y values without NaN
+      n_out (int): the number of points to keep
+
+    Returns:
+      numpy.ndarray: sorted indices of the kept points
+    """
+    n = len(y)
+    if n_out >= n:
+        return numpy.arange(n)
+    if n_out < 2:
+        raise ArgumentValueError('Min/max envelopes need at least 2 points, got: %d' % n_out)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n_buckets = n_out // 2
+    tail = n_out % 2
+    m = n - tail
+    edges = numpy.linspace(0, m, n_buckets + 1).astype(numpy.int64)
+    bucket = numpy.repeat(numpy.arange(n_buckets), numpy.diff(edges))
+    mins = numpy.minimum.reduceat(y[:m], edges[:-1])
+    maxs = numpy.maximum.reduceat(y[:m], edges[:-1])
+
+    # the first minimum and the last maximum of every bucket, so constant buckets still give two points
+    min_pos = numpy.flatnonzero(y[:m] == mins[bucket])
+    _, first = numpy.unique(bucket[min_pos], return_index=True)
+    min_idx = min_pos[first]
+    max_pos = numpy.flatnonzero(y[:m] == maxs[bucket])[::-1]
+    _, first = numpy.unique(bucket[max_pos], return_index=True)
+    max_idx = max_pos[first]
+
+    out = numpy.sort(numpy.column_stack([min_idx, max_idx]), axis=1).ravel()
+    if tail:
+        out = numpy.append(out, n - 1)
+    return out
+
+
+def downsample(df, max_points, method='lttb'):
+    """Reducing a DataFrame indexed by datetime to max_points rows
+
+    The rows are selected by the first column; rows where it is NaN are dropped first.
+
+    Args:
+      df (pandas.DataFrame): the data returned by a fetch
+      max_points (int): the point budget
+      method (str): 'lttb' or 'minmax'
+
+    Returns:
+      pandas.DataFrame: df itself when it already fits the budget, otherwise the selected rows
+    """
+    if method not in downsampling_methods:
+        raise ArgumentValueError('Invalid downsampling method: %s. Possible values are %s' % (
+            method, ', '.join(downsampling_methods)))
+    if df is None or len(df) <= max_points or len(df.columns) == 0:
+        return df
+    df = df[df.iloc[:, 0].notna()]
+    if len(df) <= max_points:
+        return df
+    y = df.iloc[:, 0].to_numpy(dtype=numpy.float64)
+    if method == 'lttb':
+        x = (df.index - df.index[0]) / pandas.Timedelta(seconds=1)
+        indices = lttb_indices(numpy.asarray(x, dtype=numpy.float64), y, max_points)
+    else:
+        indices = minmax_indices(y, max_points)
+    return df.iloc[indices]
@@ -54,6 +54,11 @@ class AccessDenied(BaseError):
     pass
 
 
+class RequestRejected(AccessDenied):
+    """The data provider rejected the request itself, e.g. with 400, so logging in again does not help"""
+    pass
+
+
 class MethodNotSupported(BaseError):
     """The request method is not supported"""
     pass
@@ -118,4 +123,14 @@ class AuthCredentialsNotFound(BaseError):
     """Authentication configuration file not found"""
     pass
 
+
+class ProviderOverloaded(BaseError):
+    """The data provider is throttling requests or failing to answer them"""
+    pass
+
+
+class SeriesNotFound(BaseError):
+    """The local store has no such series"""
+    pass
+
 # =============================================================================
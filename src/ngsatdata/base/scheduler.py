@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from ngsatdata.base.errors import *
+
+# -------- GLOBAL VARIABLES -------- #
+# priority classes, from the highest to the lowest
+priorities = ['interactive', 'normal', 'backfill']
+# the errors that mean the provider or the way to it is overloaded. Other errors, e.g. an invalid datetime,
+# fail the request without backing off
+overload_errors = (ProviderOverloaded, RequestTimeout, LocalNetworkError, ConnectionError, TimeoutError,
+                   requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# the number of outcomes the window needs before it can back off
+min_outcomes = 4
+# -------- END OF GLOBAL VARIABLES -------- #
+
+
+class TokenBucket(object):
+    """A token bucket that refills at rate tokens per second up to burst tokens. Not thread-safe by itself"""
+
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0 or burst < 1:
+            raise ArgumentValueError('rate must be positive and burst at least 1')
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def delay(self):
+        """Returning the seconds until a token is available, 0 when one is available now"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Task(object):
+    def __init__(self, fn, args, kwargs, priority, job):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.job = job
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class _Stats(object):
+    def __init__(self, window):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.overloaded = 0
+        self.waits = deque(maxlen=window)
+
+    def summary(self, queued):
+        waits = sorted(self.waits)
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'overloaded': self.overloaded,
+            'queued': queued,
+            'wait_mean': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            'wait_max': waits[-1] if waits else 0.0,
+        }
+
+
+class FetchScheduler(object):
+    """Running fetch jobs under a shared request rate, a concurrency cap, priorities and fair sharing
+
+    Requests start when a token of the rate limit is available and fewer than the current concurrency limit
+    are running. The highest priority class with queued requests always goes first; within a class the jobs
+    take turns, so one large backfill cannot hold back a smaller one. While the limit allows more than one
+    request, the other classes leave one slot free for interactive requests, so those never wait for a
+    running backfill.
+
+    The concurrency limit backs off (halves) when at least error_rate of the last adapt_window requests were
+    overloaded or slower than latency_target, and grows back by one request per round of successful ones.
+    A request is overloaded when the provider throttles or fails it (ProviderOverloaded, e.g. 429 or 5xx),
+    when it times out or cannot connect, or when fetch() gets no response at all. Other errors, like an
+    invalid datetime, count as failed but do not back off.
+
+    Attributes:
+        bucket (TokenBucket): The request rate limit.
+        max_concurrency (int): The upper bound of the concurrency limit.
+        min_concurrency (int): The lower bound of the concurrency limit.
+        latency_target (float): Seconds above which a request counts as slow.
+        error_rate (float): The share of overloaded or slow requests in the window that backs off.
+
+    Usage example:
+        from ngsatdata.base.scheduler import FetchScheduler
+        scheduler = FetchScheduler(rate=5, burst=10, max_concurrency=4)
+        future = scheduler.fetch(smdc, priority='interactive', job='dashboard',
+                                 source='electro_l2',
+                                 instrument='skl',
+                                 channel='das3vrt1',
+                                 start_dt='2017-10-14 10:43:38',
+                                 end_dt='2017-10-14 10:43:47',
+                                 time_frame='1s')
+        df = future.result()
+        print(scheduler.metrics())
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 10, max_concurrency: int = 4, min_concurrency: int = 1,
+                 latency_target: float = 10.0, error_rate: float = 0.25, adapt_window: int = 20,
+                 metrics_window: int = 1000, log_level: int = logging.INFO):
+        if min_concurrency < 1 or max_concurrency < min_concurrency:
+            raise ArgumentValueError('Expected 1 <= min_concurrency <= max_concurrency')
+        if not 0 < error_rate <= 1 or adapt_window < min_outcomes:
+            raise ArgumentValueError('Expected 0 < error_rate <= 1 and adapt_window >= %d' % min_outcomes)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.error_rate = error_rate
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        self._limit = max_concurrency
+        self._successes = 0
+        # True for every overloaded or slow request among the latest ones
+        self._outcomes = deque(maxlen=adapt_window)
+        self._running = 0
+        self._running_by = {p: 0 for p in priorities}
+        self._queues = {p: OrderedDict() for p in priorities}
+        self._stats = {p: _Stats(metrics_window) for p in priorities}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='fetch')
+        self._dispatcher = threading.Thread(target=self._dispatch, name='fetch-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return self._limit
+
+    def submit(self, fn, *args, priority: str = 'normal', job=None, **kwargs) -> Future:
+        """Queueing fn(*args, **kwargs)
+
+        Args:
+          fn (callable): the request to run
+          priority (str): 'interactive', 'normal' or 'backfill'
+          job (hashable): the job the request belongs to. Jobs of the same priority take turns
+
+        Returns:
+          concurrent.futures.Future: the result of fn
+        """
+        if priority not in self._queues:
+            raise ArgumentValueError('Invalid priority: %s. Possible values are %s' % (
+                priority, ', '.join(priorities)))
+        task = _Task(fn, args, kwargs, priority, job)
+        with self._cond:
+            if self._closed:
+                raise ArgumentValueError('The scheduler is shut down')
+            self._queues[priority].setdefault(job, deque()).append(task)
+            self._stats[priority].submitted += 1
+            self._cond.notify_all()
+        return task.future
+
+    def fetch(self, provider, priority: str = 'normal', job=None, **kwargs) -> Future:
+        """Queueing provider.fetch(**kwargs). A fetch without a response fails with ProviderOverloaded"""
+        return self.submit(_fetch, provider, priority=priority, job=job, **kwargs)
+
+    def metrics(self):
+        """Returning the queue wait statistics per priority and the current limits"""
+        with self._cond:
+            result = {p: self._stats[p].summary(sum(len(q) for q in self._queues[p].values()))
+                      for p in priorities}
+            result['running'] = self._running
+            result['concurrency_limit'] = self.concurrency_limit
+            return result
+
+    def shutdown(self, wait: bool = True):
+        """Stopping the scheduler. Requests that have not started yet are cancelled"""
+        with self._cond:
+            self._closed = True
+            for queues in self._queues.values():
+                for tasks in queues.values():
+                    for task in tasks:
+                        task.future.cancel()
+                queues.clear()
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _next_priority(self):
+        """Returning the highest priority class with queued requests that may start one now, or None"""
+        limit = self.concurrency_limit
+        if self._running >= limit:
+            return None
+        # the slot kept free for the highest priority class
+        reserved = 1 if limit > 1 else 0
+        for priority in priorities:
+            if not self._queues[priority]:
+                continue
+            if priority != priorities[0] and self._running - self._running_by[priorities[0]] >= limit - reserved:
+                continue
+            return priority
+        return None
+
+    def _next_task(self, priority):
+        """Popping the next request of a priority class, the jobs of the class in turn"""
+        queues = self._queues[priority]
+        job, tasks = next(iter(queues.items()))
+        task = tasks.popleft()
+        del queues[job]
+        if tasks:
+            queues[job] = tasks
+        return task
+
+    def _dispatch(self):
+        with self._cond:
+            while not self._closed:
+                priority = self._next_priority()
+                if priority is None:
+                    self._cond.wait()
+                    continue
+                delay = self.bucket.delay()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                task = self._next_task(priority)
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                self.bucket.take()
+                self._running += 1
+                self._running_by[task.priority] += 1
+                self._stats[task.priority].waits.append(time.monotonic() - task.enqueued)
+                self._executor.submit(self._run, task)
+
+    def _run(self, task):
+        started = time.monotonic()
+        error = None
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+        except BaseException as e:
+            error = e
+        latency = time.monotonic() - started
+        overloaded = isinstance(error, overload_errors)
+        with self._cond:
+            self._running -= 1
+            self._running_by[task.priority] -= 1
+            stats = self._stats[task.priority]
+            stats.completed += 1
+            if error is not None:
+                stats.failed += 1
+            if overloaded:
+                stats.overloaded += 1
+            self._adapt(overloaded or latency > self.latency_target, latency)
+            self._cond.notify_all()
+        if error is not None:
+            task.future.set_exception(error)
+        else:
+            task.future.set_result(result)
+
+    def _adapt(self, congested, latency):
+        """Halving the concurrency limit when too many of the latest requests were overloaded or slow,
+        growing it back on successes
+        """
+        self._outcomes.append(congested)
+        if congested:
+            self._successes = 0
+            bad = sum(self._outcomes)
+            if len(self._outcomes) >= min_outcomes and bad >= self.error_rate * len(self._outcomes):
+                self._limit = max(self.min_concurrency, self._limit // 2)
+                self.logger.warning('Backing off to %d concurrent requests (%d of the last %d requests '
+                                    'overloaded or slow, latency %.2fs)' % (
+                                        self.concurrency_limit, bad, len(self._outcomes), latency))
+                # the next back off needs fresh evidence from requests made under the new limit
+                self._outcomes.clear()
+        else:
+            self._successes += 1
+            if self._successes >= self._limit:
+                self._limit = min(self.max_concurrency, self._limit + 1)
+                self._successes = 0
+
+
+def _fetch(provider, **kwargs):
+    result = provider.fetch(**kwargs)
+    if result is None:
+        raise ProviderOverloaded('The provider did not answer the request')
+    return result
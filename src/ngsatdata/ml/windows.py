@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import queue
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy
+import pandas
+
+from ngsatdata.base.errors import *
+from ngsatdata.providers.smdc import dt_format, time_frame_2_seconds
+from ngsatdata.store.loader import SMDCLoader, series_key, split_range
+from ngsatdata.store.mmapstore import MmapStore
+
+
+def channel_spec(spec):
+    """Normalizing a channel spec to a (source, instrument, channel, level) tuple
+
+    Args:
+      spec: a Channel object, a dict with 'source', 'instrument', 'channel' and optional 'level' keys,
+        or a (source, instrument, channel[, level]) tuple
+    """
+    if hasattr(spec, 'codename') and hasattr(spec, 'instrument_name'):
+        return spec.source_name, spec.instrument_name, spec.codename, 'default'
+    if isinstance(spec, dict):
+        try:
+            return spec['source'], spec['instrument'], spec['channel'], spec.get('level', 'default')
+        except KeyError as e:
+            raise ArgumentValueError('Channel spec %r has no %s' % (spec, e))
+    if isinstance(spec, (tuple, list)) and len(spec) in (3, 4):
+        return tuple(spec) + ('default',) * (4 - len(spec))
+    raise ArgumentValueError('Invalid channel spec: %r' % (spec,))
+
+
+class RunningStats(object):
+    """Per-column count, mean and variance merged chunk by chunk (Chan et al.), ignoring NaN values"""
+
+    def __init__(self, n_columns):
+        self.count = numpy.zeros(n_columns)
+        self.mean = numpy.zeros(n_columns)
+        self.m2 = numpy.zeros(n_columns)
+
+    def update(self, values):
+        count = numpy.sum(~numpy.isnan(values), axis=0)
+        present = count > 0
+        if not present.any():
+            return
+        mean = numpy.zeros_like(self.mean)
+        m2 = numpy.zeros_like(self.m2)
+        mean[present] = numpy.nanmean(values[:, present], axis=0)
+        m2[present] = numpy.nansum((values[:, present] - mean[present]) ** 2, axis=0)
+        total = self.count + count
+        delta = mean - self.mean
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            ratio = numpy.where(total > 0, count / total, 0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * ratio
+        self.count = total
+
+    @property
+    def std(self):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            std = numpy.sqrt(numpy.where(self.count > 0, self.m2 / self.count, 0))
+        # constant or empty columns are left unscaled
+        return numpy.where(std > 0, std, 1.0)
+
+
+class WindowedBatchLoader(object):
+    """Producing fixed-length strided windows of several channels as batched NumPy tensors
+
+    The time range is read chunk by chunk, either from the provider or from a local MmapStore, and every
+    chunk is aligned onto a regular grid of ``time_frame`` steps. Chunks are read ahead on a thread pool and
+    batches are assembled on a background thread, so the training loop only waits when it outruns the reads.
+
+    Normalizing needs a first pass over the range for the statistics. Without a store, the chunks of that pass
+    are kept in a temporary MmapStore that is removed with the loader, so every chunk is fetched only once.
+    Passing precomputed mean and std skips the first pass.
+
+    Attributes:
+        channels (list): The (source, instrument, channel, level) tuples of the window columns.
+        window (int): The number of time steps per window.
+        stride (int): The number of time steps between the starts of consecutive windows.
+        batch_size (int): The number of windows per batch.
+        mean (numpy.ndarray): Per-channel mean, given or set by compute_stats().
+        std (numpy.ndarray): Per-channel standard deviation, given or set by compute_stats().
+
+    Usage example:
+        from ngsatdata.ml.windows import WindowedBatchLoader
+        from ngsatdata.providers.smdc import SMDC
+        from ngsatdata.store.mmapstore import MmapStore
+        smdc = SMDC()
+        smdc.authorize()
+        loader = WindowedBatchLoader(channels=[('electro_l2', 'skl', 'das3vrt1'),
+                                               ('electro_l2', 'skl', 'das3vrt2')],
+                                     start_dt='2017-10-01 00:00:00',
+                                     end_dt='2017-10-31 23:59:59',
+                                     time_frame='1m',
+                                     window=120,
+                                     stride=30,
+                                     batch_size=64,
+                                     provider=smdc,
+                                     store=MmapStore('/data/smdc'))
+        for batch in loader:
+            # batch.shape == (64, 120, 2)
+            ...
+    """
+
+    def __init__(self, channels, start_dt, end_dt, time_frame, window, stride=1, batch_size=32,
+                 provider=None, store: MmapStore = None, chunk: timedelta = timedelta(days=1),
+                 workers: int = 2, prefetch: int = 4, normalize: bool = True, drop_incomplete: bool = True,
+                 drop_last: bool = False, dtype=numpy.float32, mean=None, std=None,
+                 log_level: int = logging.INFO):
+        if provider is None and store is None:
+            raise ArgumentValueError('Either a provider or a store is required')
+        if time_frame not in time_frame_2_seconds:
+            raise TimeFrameNotAvailable('Windows need a fixed time frame, got: %s' % time_frame)
+        if window < 1 or stride < 1 or batch_size < 1:
+            raise ArgumentValueError('window, stride and batch_size must be positive integers')
+        self.channels = [channel_spec(c) for c in channels]
+        if not self.channels:
+            raise ArgumentValueError('At least one channel is required')
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.time_frame = time_frame
+        self.step = timedelta(seconds=time_frame_2_seconds[time_frame])
+        self.window = window
+        self.stride = stride
+        self.batch_size = batch_size
+        self.provider = provider
+        self.store = store
+        # whole steps per chunk keep the grids of consecutive chunks contiguous
+        steps_per_chunk = max(2, -(-chunk // self.step))
+        self.chunks = split_range(start_dt, end_dt, self.step * steps_per_chunk)
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self.normalize = normalize
+        self.drop_incomplete = drop_incomplete
+        self.drop_last = drop_last
+        self.dtype = dtype
+        if (mean is None) != (std is None):
+            raise ArgumentValueError('mean and std must be given together')
+        self.mean = None if mean is None else numpy.asarray(mean, dtype=numpy.float64)
+        self.std = None if std is None else numpy.asarray(std, dtype=numpy.float64)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        # (key, chunk start) of the chunks this loader has fetched into the store
+        self._fetched = set()
+        if provider is not None and store is not None:
+            self._store_loader = SMDCLoader(provider, store)
+
+    def compute_stats(self):
+        """Computing per-channel mean and standard deviation in a single streaming pass over the chunks"""
+        if self.store is None:
+            root = tempfile.mkdtemp(prefix='ngsatdata-')
+            weakref.finalize(self, shutil.rmtree, root, True)
+            self.store = MmapStore(root)
+            self._store_loader = SMDCLoader(self.provider, self.store)
+        stats = RunningStats(len(self.channels))
+        for values in self._iter_chunks():
+            stats.update(values)
+        self.mean = stats.mean
+        self.std = stats.std
+        return self.mean, self.std
+
+    def __iter__(self):
+        if self.normalize and self.mean is None:
+            self.compute_stats()
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _produce(self, batches, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for batch in self._batches():
+                if not put(batch):
+                    return
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    def _batches(self):
+        n_channels = len(self.channels)
+        carry = numpy.empty((0, n_channels))
+        # rows of the next chunks that lie before the next window start when stride > window
+        skip = 0
+        pending = []
+        n_pending = 0
+        for values in self._iter_chunks():
+            if self.normalize:
+                values = (values - self.mean) / self.std
+            if skip:
+                dropped = min(skip, len(values))
+                values = values[dropped:]
+                skip -= dropped
+            buffer = numpy.concatenate([carry, values]) if len(carry) else values
+            n_windows = 0 if len(buffer) < self.window else (len(buffer) - self.window) // self.stride + 1
+            if n_windows:
+                # (n_windows, window, n_channels) read-only views of the buffer
+                row, column = buffer.strides
+                windows = numpy.lib.stride_tricks.as_strided(buffer, shape=(n_windows, self.window, n_channels),
+                                                             strides=(row * self.stride, row, column),
+                                                             writeable=False)
+                if self.drop_incomplete:
+                    windows = windows[~numpy.isnan(windows).any(axis=(1, 2))]
+                pending.append(windows.astype(self.dtype))
+                n_pending += len(windows)
+            carry = buffer[n_windows * self.stride:]
+            skip += max(0, n_windows * self.stride - len(buffer))
+            while n_pending >= self.batch_size:
+                merged = numpy.concatenate(pending)
+                yield merged[:self.batch_size]
+                pending = [merged[self.batch_size:]]
+                n_pending -= self.batch_size
+        if n_pending and not self.drop_last:
+            yield numpy.concatenate(pending)
+
+    def _iter_chunks(self):
+        """Yielding the chunks in order as (n_steps, n_channels) arrays while reading ahead on a thread pool
+
+        Only the fetches run on the pool. Fetched chunks are written to the store here, in chunk order, so
+        every write appends to the stored series instead of rewriting it.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = deque()
+            chunks = iter(self.chunks)
+            for chunk in chunks:
+                futures.append((chunk[0], executor.submit(self._read_chunk, *chunk)))
+                if len(futures) >= self.prefetch:
+                    break
+            while futures:
+                chunk_start, future = futures.popleft()
+                values, fetched = future.result()
+                for chunk in chunks:
+                    futures.append((chunk[0], executor.submit(self._read_chunk, *chunk)))
+                    break
+                if self.store is not None:
+                    for key, channel, df in fetched:
+                        self._store_loader.write(key, channel, df)
+                        self._fetched.add((key, chunk_start))
+                yield values
+
+    def _read_chunk(self, chunk_start, chunk_end):
+        """Reading a chunk of every channel
+
+        Returns:
+          tuple: the (n_steps, n_channels) array and the (key, channel, DataFrame) results fetched from the
+          provider, which are not in the store yet
+        """
+        grid = pandas.date_range(chunk_start, chunk_end, freq=self.step)
+        columns = []
+        fetched = []
+        for source, instrument, channel, level in self.channels:
+            key = series_key(source, instrument, channel, self.time_frame, level)
+            df, from_provider = self._read_channel(key, source, instrument, channel, level, chunk_start, chunk_end)
+            if from_provider:
+                fetched.append((key, channel, df))
+            if df is None or len(df) == 0:
+                columns.append(numpy.full(len(grid), numpy.nan))
+                continue
+            series = df.iloc[:, 0]
+            series = series[~series.index.duplicated(keep='last')].sort_index()
+            series.index = series.index.astype('datetime64[ns]')
+            columns.append(series.reindex(grid.astype('datetime64[ns]'), method='nearest',
+                                          tolerance=self.step / 2).to_numpy(dtype=numpy.float64))
+        return numpy.column_stack(columns), fetched
+
+    def _read_channel(self, key, source, instrument, channel, level, chunk_start, chunk_end):
+        """Reading a chunk of a channel from the store, or from the provider when the store does not hold it
+
+        Returns:
+          tuple: the DataFrame (or None) and whether it was fetched from the provider
+        """
+        if (key, chunk_start) in self._fetched:
+            return (self.store.frame(key, chunk_start, chunk_end) if key in self.store else None), False
+        if self.store is not None and key in self.store:
+            df = self.store.frame(key, chunk_start, chunk_end)
+            # a chunk counts as cached when the store holds rows at both of its edges
+            if self.provider is None or (len(df) and df.index[0] - chunk_start < self.step and
+                                         chunk_end - df.index[-1] < self.step):
+                return df, False
+        if self.provider is None:
+            return None, False
+        df = self.provider.fetch(source=source,
+                                 instrument=instrument,
+                                 channel=channel,
+                                 start_dt=chunk_start.strftime(dt_format),
+                                 end_dt=chunk_end.strftime(dt_format),
+                                 time_frame=self.time_frame,
+                                 level=level)
+        if isinstance(df, list):
+            df = df[0] if df else None
+        return df, True
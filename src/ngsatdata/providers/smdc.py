@@ -3,15 +3,21 @@
 import json
 import logging
 import os
+import threading
 import traceback
 from datetime import datetime
 from typing import Dict
 
+import numpy
 import pandas
 import requests
 import six
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
 
+from ngsatdata.base.coverage import CoverageIndex, to_seconds
 from ngsatdata.base.dataprovider import DataProvider
+from ngsatdata.base.downsampling import downsample
 from ngsatdata.base.errors import *
 
 from .source import Source
@@ -37,6 +43,15 @@ satellite_2_noradid = {
     'vernov': 40070,
 }
 time_frames = ['1s', '10s', '1m', '5m', '10m', '1h', '6h', 'auto']
+time_frame_2_seconds = {
+    '1s': 1,
+    '10s': 10,
+    '1m': 60,
+    '5m': 300,
+    '10m': 600,
+    '1h': 3600,
+    '6h': 21600,
+}
 dt_format = '%Y-%m-%d %H:%M:%S'
 # -------- END OF GLOBAL VARIABLES -------- #
 
@@ -44,13 +59,20 @@ dt_format = '%Y-%m-%d %H:%M:%S'
 class SMDC(DataProvider):
     """The driver to work with the SMDC provider
 
+    An instance can be shared across threads. Every thread gets its own requests.Session, while all of them
+    share one pooled HTTP adapter and the cookies of the last login. Logging in again after the provider
+    has expired the session happens once, no matter how many threads notice it at the same time.
+
     Attributes:
         logger (obj): The internal Python logging object.
         auth_url (str): The URL for authorization.
         api_url (str): The URL for api access
-        auth_input_form (dict): 
-        cookie_names (dict):
-    
+        auth_input_form (dict): The login form fields.
+        cookie_names (dict): The names of the session id and the csrf token cookies.
+        pool_maxsize (int): The maximum number of connections kept open to the provider.
+        coverage (CoverageIndex): The known-present and known-empty intervals of the channels. Fetches that
+            fall into a known-empty interval are answered with an empty DataFrame without a request.
+
     Usage example:
         from ngsatdata.providers.smdc import SMDC
         smdc = SMDC()
@@ -63,23 +85,26 @@ class SMDC(DataProvider):
                         time_frame='1s',
                         level='default')
     """
-    # smdc auth credential related
-    auth_input_form: Dict = {
-        'username': None,
-        'password': None,
-        'csrfmiddlewaretoken': None
-    }
-    cookie_names: Dict = {
-        'sid': 'sessionid',
-        'csrf': 'csrftoken'
-    }
-    headers: Dict = {}
-    metadata: Dict = {
-        # fill the metadata with data from the provider
-    }
-
-    def __init__(self, base_url: str = 'http://localhost:8000', log_level: int = logging.INFO):
+
+    def __init__(self, base_url: str = 'http://localhost:8000', log_level: int = logging.INFO,
+                 pool_connections: int = 10, pool_maxsize: int = 10, max_retries: int = 3,
+                 coverage: CoverageIndex = None):
         self.logger = self.get_logger(module_name=__name__, log_level=log_level)
+        self.coverage = coverage
+        # smdc auth credential related
+        self.auth_input_form: Dict = {
+            'username': None,
+            'password': None,
+            'csrfmiddlewaretoken': None
+        }
+        self.cookie_names: Dict = {
+            'sid': 'sessionid',
+            'csrf': 'csrftoken'
+        }
+        self.headers: Dict = {}
+        self.metadata: Dict = {
+            # fill the metadata with data from the provider
+        }
         if base_url:
             self.base_url = base_url
             self.auth_url = self.base_url + '/accounts/login/'
@@ -89,6 +114,41 @@ class SMDC(DataProvider):
                 'referer': self.base_url + '/accounts/login/'
             }
 
+        self.pool_maxsize = pool_maxsize
+        # urllib3 connection pools are thread-safe, so a single adapter serves the sessions of all threads
+        self._adapter = HTTPAdapter(pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize,
+                                    max_retries=max_retries,
+                                    pool_block=True)
+        self._local = threading.local()
+        self._auth_lock = threading.Lock()
+        self._auth_generation = 0
+        self._cookies = RequestsCookieJar()
+
+    @property
+    def session(self):
+        """The requests.Session of the calling thread, holding the cookies of the last login"""
+        local = self._local
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = self._new_session()
+            local.generation = -1
+        if local.generation != self._auth_generation:
+            with self._auth_lock:
+                session.cookies.clear()
+                session.cookies.update(self._cookies)
+                local.generation = self._auth_generation
+        return session
+
+    def _new_session(self):
+        session = requests.Session()
+        session.mount('http://', self._adapter)
+        session.mount('https://', self._adapter)
+        return session
+
+    def close(self):
+        """Closing the pooled connections of all threads"""
+        self._adapter.close()
 
     def authorize(self):
         cur_dir = os.path.dirname(os.path.abspath(__file__))
@@ -105,27 +165,48 @@ class SMDC(DataProvider):
             if 'username' not in auth_obj or 'password' not in auth_obj:
                 raise AuthCredentialsNotFound('Please specify username and password in the config file')
 
-        self.auth_input_form['username'] = auth_obj['username']
-        self.auth_input_form['password'] = auth_obj['password']
+        with self._auth_lock:
+            self.auth_input_form['username'] = auth_obj['username']
+            self.auth_input_form['password'] = auth_obj['password']
+            return self._login()
+
+    def reauthorize(self, generation):
+        """Logging in again with the stored credentials unless another thread already did it
+
+        Args:
+          generation (int): the login generation the caller's failed request was made with
 
+        Returns:
+          bool: True once a login newer than generation exists
+        """
+        with self._auth_lock:
+            if self._auth_generation != generation:
+                return True
+            self.logger.info('Session expired. Logging in to %s again' % self.auth_url)
+            return self._login()
+
+    def _login(self):
+        """Logging in with a fresh session and publishing its cookies to all threads. Needs self._auth_lock"""
         super(SMDC, self).authorize()
-        self.session = requests.Session()
+        session = self._new_session()
         # use get to retrieve the csrf token
-        self.session.get(self.auth_url)
+        session.get(self.auth_url)
         # set the csrf token
-        if self.cookie_names['csrf'] not in self.session.cookies.keys():
+        if self.cookie_names['csrf'] not in session.cookies.keys():
             message = 'Error retrieving csrf token'
             # self.logger.debug(message)
             raise AuthenticationError(message)
 
-        self.auth_input_form['csrfmiddlewaretoken'] = self.session.cookies[self.cookie_names['csrf']]
+        self.auth_input_form['csrfmiddlewaretoken'] = session.cookies[self.cookie_names['csrf']]
 
         # authorize with the backend
-        r = self.session.post(self.auth_url, data=self.auth_input_form, headers=self.headers)
-        if r.status_code == 200 and self.cookie_names['sid'] in self.session.cookies.keys():
-            #self.logger.debug(self.cookie_names['sid'] + '=' + self.session.cookies[self.cookie_names['sid']])
-            #self.logger.debug(self.cookie_names['csrf'] + '=' + self.session.cookies[self.cookie_names['csrf']])
+        r = session.post(self.auth_url, data=self.auth_input_form, headers=self.headers)
+        if r.status_code == 200 and self.cookie_names['sid'] in session.cookies.keys():
+            #self.logger.debug(self.cookie_names['sid'] + '=' + session.cookies[self.cookie_names['sid']])
+            #self.logger.debug(self.cookie_names['csrf'] + '=' + session.cookies[self.cookie_names['csrf']])
             #self.logger.debug('Logged in to %s' % self.auth_url)
+            self._cookies = session.cookies.copy()
+            self._auth_generation += 1
             return True
         else:
             message = 'Error logging in to %s. Invalid credentials' % self.auth_url
@@ -133,12 +214,13 @@ class SMDC(DataProvider):
             raise AuthenticationError(message)
 
     def get_sources(self):
-        response = self.session.get(self.metadata_url, headers=self.headers)
-        metadata = response.json()
+        metadata = json.loads(self._get_metadata())
+        self.metadata = metadata
         return [Source(codename=codename, metadata=source_metadata)
                 for codename, source_metadata in metadata['data'].items()]
 
-    def fetch(self, source, instrument, channel, start_dt, end_dt, time_frame, level='default', *args, **kargs):
+    def fetch(self, source, instrument, channel, start_dt, end_dt, time_frame, level='default',
+              max_points=None, downsampling='lttb', use_coverage=True, *args, **kargs):
         """Fetching data from a column of a table in a schema for a time interval with specific time frame
 
 
@@ -166,38 +248,174 @@ class SMDC(DataProvider):
           end_dt (datetime or str): datetime object or datetime string which defines the end timestamp of a interval
           time_frame (str): time frame. Possible values are 'h6', 'h1', 'm10', 'm5', 'm1', 's10', 's1', 'ms100', or 'auto'
           level (str): data level. Possible values are raw (or level0), level1a, level1b, level1, level2
+          max_points (int): the point budget, e.g. the width of a plot in pixels. If set, the coarsest
+            available time frame that still gives max_points points is requested, and the result is
+            downsampled to exactly max_points points
+          downsampling (str): the downsampling method for max_points. Possible values are 'lttb' and 'minmax'
+          use_coverage (bool): answer intervals the coverage index knows to be empty without a request. With
+            False, the provider is always asked and the index is refreshed from its response
         Returns:
           a Pandas Data Frame that contains the data provided by the data provider
 
         Raises:
           AccessDenied
           MethodNotSupported
+          ProviderOverloaded: the provider answered with 429 or 5xx
         """
 
+        if max_points is not None:
+            if max_points < 3:
+                raise ArgumentValueError('max_points must be at least 3, got: %s' % max_points)
+            time_frame = self._select_time_frame(source, instrument, channel, start_dt, end_dt, time_frame,
+                                                 max_points)
+
+        coverage_key = self.coverage_key(source, instrument, channel, time_frame, level)
+        if use_coverage and self.coverage is not None and self.coverage.is_empty(coverage_key, start_dt, end_dt):
+            self.logger.debug('%s has no data in %s - %s' % (coverage_key, start_dt, end_dt))
+            return pandas.DataFrame()
+
         try:
             query = self._form_query(source, instrument, channel, start_dt, end_dt, time_frame, level)
-            headers = {
-                'Accept': 'application/json',
-                'Content-type': 'application/json',
-                # 'Cookie': '%s:%s;%s:%s' % ( self.cookie_names['sid'],
-                #                             self.session.cookies[self.cookie_names['sid']],
-                #                             self.cookie_names['csrf'],
-                #                             self.session.cookies[self.cookie_names['csrf']]),
-                'X-CSRFToken': self.session.cookies[self.cookie_names['csrf']],
-            }
-            # print(headers)
-            # Todo backend won't accept the request without csrf_exempt. Need to work on that
-            response = super(SMDC, self).fetch(self.api_url + 'query/', method='POST',
-                                               headers=headers, payload=json.dumps(query))
-            self._print_json_response(response)
-            df = self._json_2_dataframe(response)
+            response = self._query(json.dumps(query))
+            jobj = json.loads(response) if response is not None else None
+            self._print_json_response(jobj)
+            if self.coverage is not None and jobj is not None:
+                self._learn_coverage(coverage_key, start_dt, end_dt, time_frame, jobj)
+            df = self._json_2_dataframe(jobj)
+            if max_points is not None:
+                if isinstance(df, list):
+                    df = [downsample(d, max_points, downsampling) for d in df]
+                else:
+                    df = downsample(df, max_points, downsampling)
             return df
 
         except (AccessDenied, MethodNotSupported) as e:
             raise
 
+    def _query(self, payload):
+        """Posting a JSON encoded query to the API
+
+        Returns:
+          str: the JSON encoded response
+        """
+        return self._with_login(lambda session: self._post_query(session, payload))
+
+    def _get_metadata(self):
+        """Getting the JSON encoded metadata of all sources"""
+        return self._with_login(lambda session: super(SMDC, self).fetch(self.metadata_url, method='GET',
+                                                                        headers=self.headers))
+
+    def _with_login(self, request):
+        """Running request(session)
+
+        When the provider rejects the session (401 or 403), the client logs in again (once for all threads)
+        and repeats the request. Requests the provider rejects as invalid raise RequestRejected right away.
+        """
+        session = self.session
+        generation = self._local.generation
+        try:
+            return request(session)
+        except RequestRejected:
+            raise
+        except AccessDenied:
+            if generation == 0:
+                raise
+            self.reauthorize(generation)
+            return request(self.session)
+
+    def _post_query(self, session, payload):
+        headers = {
+            'Accept': 'application/json',
+            'Content-type': 'application/json',
+            'X-CSRFToken': session.cookies.get(self.cookie_names['csrf'], ''),
+        }
+        # Todo backend won't accept the request without csrf_exempt. Need to work on that
+        return super(SMDC, self).fetch(self.api_url + 'query/', method='POST', headers=headers, payload=payload)
+
+    def _select_time_frame(self, source, instrument, channel, start_dt, end_dt, time_frame, max_points):
+        """Selecting the coarsest available time frame that still gives at least max_points points
+
+        The requested time frame is kept when it is already coarser. When even the finest time frame gives
+        fewer points than max_points, the finest one is used.
+
+        Returns:
+          str: the time frame to request
+        """
+        try:
+            span = (datetime.strptime(end_dt, dt_format) - datetime.strptime(start_dt, dt_format)).total_seconds()
+        except (TypeError, ValueError):
+            raise DatetimeValueError('Invalid datetime range: %s - %s' % (start_dt, end_dt))
+
+        available = self._channel_time_frames(source, instrument, channel)
+        candidates = sorted((tf for tf in available if tf in time_frame_2_seconds), key=time_frame_2_seconds.get)
+        if not candidates:
+            return time_frame
+        selected = candidates[0]
+        for tf in candidates:
+            if span / time_frame_2_seconds[tf] + 1 >= max_points:
+                selected = tf
+        if time_frame in time_frame_2_seconds and time_frame_2_seconds[time_frame] > time_frame_2_seconds[selected]:
+            selected = time_frame
+        self.logger.debug('Selected time frame %s for %d points over %s - %s' % (
+            selected, max_points, start_dt, end_dt))
+        return selected
+
+    def _channel_time_frames(self, source, instrument, channel):
+        """Returning the time frames of a channel from the cached metadata, or all time frames when
+        the metadata has not been loaded with get_sources()
+        """
+        sources = self.metadata.get('data', {}) if self.metadata else {}
+        source_metadata = sources.get(source, sources.get(self._resolve_source(source)))
+        if source_metadata:
+            instrument_metadata = source_metadata.get('instruments', {}).get(instrument)
+            if instrument_metadata and instrument_metadata.get('series'):
+                return instrument_metadata['series'][0].get('avg') or time_frames
+        return time_frames
+
+    def coverage_key(self, source, instrument, channel, time_frame, level='default'):
+        """Forming the coverage index key of a channel at a time frame, e.g. '41105.skl.das3vrt1.1s'
+
+        Every time frame has its own key: a dropout of a few 1s points is not a gap of the 1m series.
+        """
+        key = self._resolve_source(source) + '.' + instrument + '.' + channel + '.' + time_frame
+        if level != 'default':
+            key += '.' + level
+        return key
+
+    def _learn_coverage(self, key, start_dt, end_dt, time_frame, jobj):
+        """Recording which parts of [start_dt, end_dt] hold data according to a successful response
+
+        A response without points marks the whole interval as empty. With a fixed time frame, the runs of
+        consecutive points are marked as present and everything more than one step away from a point as empty.
+        """
+        for series in jobj['data']:
+            if series['result']['code'] != 0:
+                continue
+            dts = series['response'][0]
+            if len(dts) == 0:
+                self.coverage.mark_empty(key, start_dt, end_dt)
+                continue
+            if time_frame not in time_frame_2_seconds:
+                continue
+            if isinstance(dts[0], str):
+                seconds = pandas.to_datetime(dts).values.astype('datetime64[s]').view(numpy.int64)
+            else:
+                seconds = numpy.asarray(dts, dtype=numpy.int64)
+            step = time_frame_2_seconds[time_frame]
+            breaks = numpy.flatnonzero(numpy.diff(seconds) > step)
+            run_starts = numpy.append(seconds[0], seconds[breaks + 1])
+            run_ends = numpy.append(seconds[breaks], seconds[-1])
+            empty = [(to_seconds(start_dt), int(run_starts[0]) - step)]
+            empty += [(int(lo) + step, int(hi) - step) for lo, hi in zip(run_ends[:-1], run_starts[1:])]
+            empty.append((int(run_ends[-1]) + step, to_seconds(end_dt)))
+            self.coverage.update(key,
+                                 present=[(int(lo), int(hi)) for lo, hi in zip(run_starts, run_ends)],
+                                 empty=empty)
+
     def _print_json_response(self, response):
-        r = json.loads(response)
+        if response is None:
+            return
+        r = json.loads(response) if isinstance(response, six.string_types) else response
         self.logger.debug(r)
         for elem in r['data']:
             self.logger.debug('request: %s' % elem['request'])
@@ -221,6 +439,8 @@ class SMDC(DataProvider):
 
         if isinstance(json_obj, six.string_types):
             jobj = json.loads(json_obj)
+        else:
+            jobj = json_obj
 
         dfs = []
         try:
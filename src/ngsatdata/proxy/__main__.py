@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""Running the SMDC caching proxy
+
+Usage example:
+    export SMDC_CONFIG_JSON=`pwd`/smdc_config.json
+    python -m ngsatdata.proxy --base-url http://smdc.sinp.msu.ru --port 8001
+"""
+
+import argparse
+import json
+import logging
+
+from ngsatdata.providers.smdc import SMDC
+
+from .server import SMDCProxy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ngsatdata.proxy', description='SMDC caching proxy')
+    parser.add_argument('--base-url', default='http://localhost:8000', help='the URL of the upstream provider')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address to listen on. Clients must log in, but the proxy speaks plain HTTP, '
+                             'so listen beyond localhost only on a trusted network')
+    parser.add_argument('--port', type=int, default=8001, help='the port to listen on')
+    parser.add_argument('--query-ttl', type=float, default=3600, help='seconds a query response stays cached')
+    parser.add_argument('--metadata-ttl', type=float, default=86400, help='seconds the metadata stays cached')
+    parser.add_argument('--max-entries', type=int, default=1024, help='the number of cached query responses')
+    parser.add_argument('--pool-maxsize', type=int, default=10, help='the number of upstream connections')
+    parser.add_argument('--users', default=None,
+                        help='a JSON file of {"username": "password"} pairs that may log in to the proxy. '
+                             'By default clients log in with the credentials of SMDC_CONFIG_JSON')
+    parser.add_argument('--session-ttl', type=float, default=86400,
+                        help='seconds a client session stays valid after its last request')
+    parser.add_argument('--debug', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    credentials = None
+    if args.users:
+        with open(args.users, 'r') as f:
+            credentials = json.load(f)
+
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    upstream = SMDC(base_url=args.base_url, log_level=log_level, pool_maxsize=args.pool_maxsize)
+    upstream.authorize()
+    proxy = SMDCProxy(upstream, host=args.host, port=args.port, query_ttl=args.query_ttl,
+                      metadata_ttl=args.metadata_ttl, max_entries=args.max_entries, credentials=credentials,
+                      session_ttl=args.session_ttl, log_level=log_level)
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.server.server_close()
+        upstream.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+import hmac
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict
+from urllib.parse import parse_qs
+
+from ngsatdata.base.errors import *
+
+# -------- GLOBAL VARIABLES -------- #
+login_path = '/accounts/login/'
+query_path = '/db_iface/api/v2/query/'
+metadata_path = '/db_iface/api/v1/full/'
+stats_path = '/proxy/stats/'
+# seconds a csrf token of the login form stays valid
+csrf_ttl = 3600
+# -------- END OF GLOBAL VARIABLES -------- #
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which only exists from Python 3.7 on"""
+    daemon_threads = True
+
+
+class _Flight(object):
+    """A computation in progress that other requests for the same key wait for"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache(object):
+    """A thread-safe LRU cache with a time-to-live that computes every missing key only once
+
+    Concurrent requests for a key that is being computed wait for that computation instead of starting
+    their own.
+
+    Attributes:
+        ttl (float): Seconds an entry stays fresh.
+        max_entries (int): The number of entries kept before the least recently used ones are dropped.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """Returning the cached value of key, or computing it with compute()
+
+        Args:
+          key (hashable): the cache key
+          compute (callable): returns a (value, cacheable) pair; values that are not cacheable are only
+            shared with the requests that waited for them
+
+        Returns:
+          the value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        cacheable = False
+        try:
+            value, cacheable = compute()
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and cacheable:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.event.set()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced}
+
+
+class ExpiringSet(object):
+    """A thread-safe set whose members expire ttl seconds after they were added or last used
+
+    At most max_entries members are kept; adding more drops the least recently used ones.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._members = OrderedDict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._members)
+
+    def add(self, member):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._members[member] = now + self.ttl
+            self._members.move_to_end(member)
+            while len(self._members) > self.max_entries:
+                self._members.popitem(last=False)
+
+    def touch(self, member) -> bool:
+        """Checking if member is in the set and extending its lifetime"""
+        now = time.monotonic()
+        with self._lock:
+            expires = self._members.get(member)
+            if expires is None or expires <= now:
+                self._members.pop(member, None)
+                return False
+            self._members[member] = now + self.ttl
+            self._members.move_to_end(member)
+            return True
+
+    def pop(self, member) -> bool:
+        """Removing member, returning whether it was in the set"""
+        with self._lock:
+            expires = self._members.pop(member, None)
+            return expires is not None and expires > time.monotonic()
+
+    def _expire(self, now):
+        # the members are ordered by their expiry, so the expired ones are at the front
+        while self._members:
+            member, expires = next(iter(self._members.items()))
+            if expires > now:
+                break
+            del self._members[member]
+
+
+class SMDCProxyHandler(BaseHTTPRequestHandler):
+    """Serving the SMDC endpoints the driver uses from the proxy's caches"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        self.server.proxy.logger.debug('%s - %s' % (self.address_string(), format % args))
+
+    def _send(self, code, body=b'', cookies=None, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (cookies or {}).items():
+            self.send_header('Set-Cookie', '%s=%s; Path=/' % (name, value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _cookies(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        return {name: morsel.value for name, morsel in cookie.items()}
+
+    def _authorized(self):
+        """Checking the session cookie, answering 403 when it is not one the proxy has issued"""
+        proxy = self.server.proxy
+        if proxy.has_session(self._cookies().get(proxy.cookie_names['sid'])):
+            return True
+        self._send(403, b'Please log in to the proxy first', content_type='text/plain')
+        return False
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        path = self.path.split('?', 1)[0]
+        if path == login_path:
+            # clients log in to the proxy, which holds the only upstream session
+            self._send(200, cookies={proxy.cookie_names['csrf']: proxy.new_csrf_token()}, content_type='text/html')
+        elif path == metadata_path:
+            if self._authorized():
+                self._respond(proxy.metadata)
+        elif path == stats_path:
+            if self._authorized():
+                self._send(200, json.dumps(proxy.stats()).encode())
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        proxy = self.server.proxy
+        path = self.path.split('?', 1)[0]
+        body = self._body()
+        if path == login_path:
+            form = {k: v[0] for k, v in parse_qs(body.decode('utf-8', 'replace')).items()}
+            csrf = self._cookies().get(proxy.cookie_names['csrf'])
+            sid = None
+            if csrf and form.get('csrfmiddlewaretoken') == csrf:
+                sid = proxy.login(form.get('username'), form.get('password'), csrf)
+            # like the provider, a failed login answers the form again without a session cookie
+            cookies = {proxy.cookie_names['sid']: sid} if sid else None
+            self._send(200, cookies=cookies, content_type='text/html')
+        elif path == query_path:
+            if self._authorized():
+                self._respond(proxy.query, body)
+        else:
+            self._send(404)
+
+    def _respond(self, handler, *args):
+        try:
+            self._send(200, handler(*args))
+        except (ArgumentValueError, RequestRejected) as e:
+            self._send(400, str(e).encode(), content_type='text/plain')
+        except AccessDenied as e:
+            self._send(403, str(e).encode(), content_type='text/plain')
+        except ProviderOverloaded as e:
+            # passed on as 503, so the clients back off too
+            self._send(503, str(e).encode(), content_type='text/plain')
+        except Exception as e:
+            self.server.proxy.logger.error('Upstream request failed: %s' % e)
+            self._send(502, str(e).encode(), content_type='text/plain')
+
+
+class SMDCProxy(object):
+    """A local caching proxy that lets many SMDC clients share one upstream session
+
+    The proxy exposes the login form, /db_iface/api/v2/query/ and /db_iface/api/v1/full/, so a client only
+    needs SMDC(base_url=...) to point at it. Identical queries are answered from a shared cache, and identical
+    queries that arrive while the first one is still upstream wait for its response instead of being sent
+    again. Cache counters are served at /proxy/stats/.
+
+    Clients have to log in before they can query: the proxy accepts the credentials it was given, by default
+    the ones the upstream driver logged in with, and answers other requests without a session it issued with
+    403. The proxy speaks plain HTTP, so expose it beyond localhost only on a trusted network.
+
+    Attributes:
+        upstream (SMDC): An authorized driver for the real provider.
+        credentials (dict): The passwords of the users that may log in to the proxy, by username.
+        sessions (ExpiringSet): The session ids issued by the proxy. A session expires session_ttl seconds
+            after its last request.
+        queries (ResultCache): The query response cache.
+        metadata_cache (ResultCache): The metadata cache.
+
+    Usage example:
+        from ngsatdata.providers.smdc import SMDC
+        from ngsatdata.proxy.server import SMDCProxy
+        upstream = SMDC(base_url='http://smdc.sinp.msu.ru')
+        upstream.authorize()
+        SMDCProxy(upstream, port=8001).serve_forever()
+
+        # in the workers
+        smdc = SMDC(base_url='http://proxy-host:8001')
+        smdc.authorize()
+    """
+
+    def __init__(self, upstream, host: str = '127.0.0.1', port: int = 8001, query_ttl: float = 3600,
+                 metadata_ttl: float = 86400, max_entries: int = 1024, credentials: Dict = None,
+                 session_ttl: float = 86400, max_sessions: int = 10000, log_level: int = logging.INFO):
+        self.upstream = upstream
+        self.cookie_names = upstream.cookie_names
+        if credentials is None:
+            username = upstream.auth_input_form['username']
+            credentials = {username: upstream.auth_input_form['password']} if username else {}
+        self.credentials = credentials
+        self.sessions = ExpiringSet(ttl=session_ttl, max_entries=max_sessions)
+        # a login form has to be posted within csrf_ttl of loading it
+        self._csrf_tokens = ExpiringSet(ttl=csrf_ttl, max_entries=max_sessions)
+        self.queries = ResultCache(ttl=query_ttl, max_entries=max_entries)
+        self.metadata_cache = ResultCache(ttl=metadata_ttl, max_entries=1)
+        self.logger = upstream.get_logger(module_name=__name__, log_level=log_level)
+        self.server = ThreadingHTTPServer((host, port), SMDCProxyHandler)
+        self.server.daemon_threads = True
+        self.server.proxy = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def new_csrf_token(self):
+        token = uuid.uuid4().hex
+        self._csrf_tokens.add(token)
+        return token
+
+    def login(self, username, password, csrf_token):
+        """Issuing a session id for valid credentials and a csrf token the proxy has issued
+
+        Returns:
+          str: the session id, or None when the login is rejected
+        """
+        if not self._csrf_tokens.pop(csrf_token):
+            return None
+        expected = self.credentials.get(username)
+        if expected is None or password is None or \
+                not hmac.compare_digest(str(expected).encode(), password.encode()):
+            self.logger.warning('Rejected login of %r' % (username,))
+            return None
+        sid = uuid.uuid4().hex
+        self.sessions.add(sid)
+        return sid
+
+    def has_session(self, sid):
+        return sid is not None and self.sessions.touch(sid)
+
+    def query(self, body: bytes) -> bytes:
+        """Answering a JSON encoded query from the cache or from the upstream provider"""
+        try:
+            query = json.loads(body)
+        except ValueError:
+            raise ArgumentValueError('The query is not valid JSON')
+        # equal queries with differently ordered keys share one cache entry
+        payload = json.dumps(query, sort_keys=True)
+        return self.queries.get(payload, lambda: self._upstream_query(payload))
+
+    def metadata(self) -> bytes:
+        return self.metadata_cache.get(metadata_path, self._upstream_metadata)
+
+    def stats(self):
+        return {'queries': self.queries.stats(), 'metadata': self.metadata_cache.stats()}
+
+    def _upstream_query(self, payload):
+        self.logger.debug('Upstream query: %s' % payload)
+        response = self.upstream._query(payload)
+        if response is None:
+            raise ProviderOverloaded('The upstream provider did not answer the query')
+        # error responses are passed on but not cached
+        codes = [series['result']['code'] for series in json.loads(response).get('data', [])]
+        return response.encode('utf-8'), all(code == 0 for code in codes)
+
+    def _upstream_metadata(self):
+        self.logger.debug('Upstream metadata: %s' % self.upstream.metadata_url)
+        response = self.upstream._get_metadata()
+        if response is None:
+            raise ProviderOverloaded('The upstream provider did not answer the metadata request')
+        return response.encode('utf-8'), True
+
+    def serve_forever(self):
+        self.logger.info('Serving SMDC proxy at %s for %s' % (self.url, self.upstream.base_url))
+        self.server.serve_forever()
+
+    def start(self):
+        """Serving on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime, timedelta
+
+import pandas
+
+from ngsatdata.base.errors import *
+from ngsatdata.providers.smdc import dt_format
+
+from .mmapstore import MmapStore
+
+
+def series_key(source, instrument, channel, time_frame, level='default'):
+    """Forming the store key of a channel series, e.g. 'electro_l2.skl.das3vrt1.1s'"""
+    key = '%s.%s.%s.%s' % (source, instrument, channel, time_frame)
+    if level != 'default':
+        key += '.' + level
+    return key
+
+
+def split_range(start_dt, end_dt, chunk: timedelta):
+    """Splitting [start_dt, end_dt] into consecutive inclusive (start, end) datetime pairs of at most chunk length"""
+    if isinstance(start_dt, str):
+        start_dt = datetime.strptime(start_dt, dt_format)
+    if isinstance(end_dt, str):
+        end_dt = datetime.strptime(end_dt, dt_format)
+    if chunk <= timedelta(seconds=1):
+        raise ArgumentValueError('chunk must be longer than one second')
+    chunks = []
+    cur = start_dt
+    while cur <= end_dt:
+        nxt = min(cur + chunk - timedelta(seconds=1), end_dt)
+        chunks.append((cur, nxt))
+        cur = nxt + timedelta(seconds=1)
+    return chunks
+
+
+class SMDCLoader(object):
+    """Filling a MmapStore with series fetched from the SMDC provider
+
+    Attributes:
+        provider (SMDC): An authorized SMDC driver. When it has a coverage index, the intervals known to be
+            empty are not requested, unless they are shorter than a chunk.
+        store (MmapStore): The local store to fill.
+        chunk (timedelta): The length of the time interval requested from the provider at once.
+
+    Usage example:
+        from ngsatdata.providers.smdc import SMDC
+        from ngsatdata.store.loader import SMDCLoader
+        from ngsatdata.store.mmapstore import MmapStore
+        smdc = SMDC()
+        smdc.authorize()
+        loader = SMDCLoader(smdc, MmapStore('/data/smdc'))
+        key = loader.load(source='electro_l2',
+                          instrument='skl',
+                          channel='das3vrt1',
+                          start_dt='2017-10-14 00:00:00',
+                          end_dt='2017-10-15 00:00:00',
+                          time_frame='1s')
+        df = loader.store.frame(key, '2017-10-14 10:43:38', '2017-10-14 10:43:47')
+    """
+
+    def __init__(self, provider, store: MmapStore, chunk: timedelta = timedelta(hours=6),
+                 log_level: int = logging.INFO):
+        self.provider = provider
+        self.store = store
+        self.chunk = chunk
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+
+    def load(self, source, instrument, channel, start_dt, end_dt, time_frame, level='default'):
+        """Fetching [start_dt, end_dt] chunk by chunk and writing the results into the store
+
+        Returns:
+          str: the store key of the series
+        """
+        key = series_key(source, instrument, channel, time_frame, level)
+        for chunk_start, chunk_end in self._chunks(source, instrument, channel, start_dt, end_dt, time_frame, level):
+            df = self.provider.fetch(source=source,
+                                     instrument=instrument,
+                                     channel=channel,
+                                     start_dt=chunk_start.strftime(dt_format),
+                                     end_dt=chunk_end.strftime(dt_format),
+                                     time_frame=time_frame,
+                                     level=level)
+            written = self.write(key, channel, df)
+            self.logger.debug('%s: %d rows for %s - %s' % (key, written, chunk_start, chunk_end))
+        return key
+
+    def _chunks(self, source, instrument, channel, start_dt, end_dt, time_frame, level):
+        """Splitting [start_dt, end_dt] into chunks, leaving out the intervals of at least a chunk that the
+        provider's coverage index knows to be empty
+        """
+        coverage = getattr(self.provider, 'coverage', None)
+        if coverage is None:
+            return split_range(start_dt, end_dt, self.chunk)
+        key = self.provider.coverage_key(source, instrument, channel, time_frame, level)
+        chunks = []
+        for interval_start, interval_end in coverage.plan(key, start_dt, end_dt, min_gap=self.chunk):
+            chunks.extend(split_range(interval_start, interval_end, self.chunk))
+        return chunks
+
+    def write(self, key, channel, df):
+        """Writing a fetch result into the store. The value column is named after the channel"""
+        if isinstance(df, list):
+            df = pandas.concat([d for d in df if len(d)], axis=1) if any(len(d) for d in df) else None
+        if df is None or len(df) == 0:
+            return 0
+        if len(df.columns) == 1:
+            df = df.rename(columns={df.columns[0]: channel})
+        return self.store.write_frame(key, df)
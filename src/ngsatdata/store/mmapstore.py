@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import threading
+from typing import Dict
+
+import numpy
+import pandas
+
+from ngsatdata.base.errors import *
+from ngsatdata.providers.smdc import time_frame_2_seconds
+
+# -------- GLOBAL VARIABLES -------- #
+meta_file = 'meta.json'
+index_file = 'index.i64'
+dt_file = 'dt.i64'
+column_suffix = '.f8'
+default_index_step = 4096
+rollup_separator = '@'
+rollup_stats = ['count', 'min', 'max', 'sum']
+# -------- END OF GLOBAL VARIABLES -------- #
+
+
+def to_ns(value):
+    """Converting a datetime-like scalar to int64 nanoseconds since the epoch
+
+    Args:
+      value (datetime, str, int or numpy.datetime64): the timestamp. Integers are taken as nanoseconds.
+
+    Returns:
+      int: nanoseconds since 1970-01-01 00:00:00
+    """
+    if isinstance(value, (int, numpy.integer)):
+        return int(value)
+    try:
+        return int(pandas.Timestamp(value).value)
+    except (ValueError, TypeError):
+        raise DatetimeValueError('Invalid datetime value: %s' % (value,))
+
+
+def to_ns_array(values):
+    """Converting a datetime-like array (DatetimeIndex, datetime64 or int64 ns array) to an int64 ns array"""
+    if isinstance(values, pandas.Index):
+        values = values.values
+    arr = numpy.asarray(values)
+    if numpy.issubdtype(arr.dtype, numpy.datetime64):
+        return arr.astype('datetime64[ns]').view(numpy.int64)
+    if numpy.issubdtype(arr.dtype, numpy.integer):
+        return arr.astype(numpy.int64, copy=False)
+    try:
+        return pandas.to_datetime(arr).values.astype('datetime64[ns]').view(numpy.int64)
+    except (ValueError, TypeError):
+        raise DatetimeValueError('Invalid datetime values')
+
+
+def raw_stats(columns):
+    """Turning value columns into per-row rollup statistics. NaN values do not count"""
+    stats = {}
+    for name, values in columns.items():
+        values = numpy.asarray(values)
+        present = ~numpy.isnan(values)
+        stats[name + '.count'] = present.astype(numpy.float64)
+        stats[name + '.min'] = values
+        stats[name + '.max'] = values
+        stats[name + '.sum'] = numpy.where(present, values, 0.0)
+    return stats
+
+
+def aggregate(dt, stats, step):
+    """Combining rollup statistics of sorted rows into buckets of step nanoseconds aligned to the epoch
+
+    Returns:
+      tuple: the bucket starts (int64 ns) and a dict of the combined statistics
+    """
+    if len(dt) == 0:
+        return numpy.empty(0, dtype=numpy.int64), {name: numpy.empty(0) for name in stats}
+    buckets = numpy.asarray(dt) // step * step
+    starts = numpy.flatnonzero(numpy.append(True, buckets[1:] != buckets[:-1]))
+    combined = {}
+    for name, values in stats.items():
+        if name.endswith('.min'):
+            combined[name] = numpy.fmin.reduceat(values, starts)
+        elif name.endswith('.max'):
+            combined[name] = numpy.fmax.reduceat(values, starts)
+        else:
+            combined[name] = numpy.add.reduceat(values, starts)
+    return buckets[starts], combined
+
+
+class MmapStore(object):
+    """A local store of time series kept as memory-mapped column files
+
+    Every series lives in its own directory under ``root``:
+
+      dt.i64         sorted int64 timestamps (nanoseconds since the epoch)
+      <column>.f8    float64 values, one file per column
+      index.i64      sparse index: every ``index_step``-th timestamp
+      meta.json      the column names and the number of rows
+
+    Slicing a time window is a binary search over the in-memory sparse index, a second one inside a single
+    block of the mapped timestamps, and a view of the mapped column files. Nothing is read or parsed.
+
+    Files are never changed in place: appending rows only extends them, and any other write replaces them
+    with new files. Views returned by ``slice`` keep showing the data as it was when they were taken.
+
+    For every series the store also keeps a rollup pyramid: one series per level of ``rollups`` coarser than
+    the data, named '<key>@<time_frame>', with count, min, max and sum of every column per bucket. Writes
+    re-aggregate only the buckets they touch, so a query at any resolution is a slice of a single level. The
+    bucket that holds the last row is still open: it is not stored but aggregated from the rows at query time,
+    so appending rows to a series only appends to its levels too.
+
+    Attributes:
+        root (str): The directory that holds the series.
+        index_step (int): The number of rows per sparse index entry for newly created series.
+        rollups (list): The time frames of the rollup levels kept for newly created series.
+
+    Usage example:
+        from ngsatdata.store.mmapstore import MmapStore
+        store = MmapStore('/data/smdc')
+        store.write_frame('electro_l2.skl.das3vrt1.1s', df)
+        dt, values = store.slice('electro_l2.skl.das3vrt1.1s', '2017-10-14 10:43:38', '2017-10-14 10:43:47')
+        hourly = store.rollup('electro_l2.skl.das3vrt1.1s', '1h', '2017-10-01 00:00:00', '2017-10-31 23:59:59')
+    """
+
+    def __init__(self, root: str, index_step: int = default_index_step, rollups=None,
+                 log_level: int = logging.INFO):
+        if index_step < 1:
+            raise ArgumentValueError('index_step must be a positive integer')
+        if rollups is None:
+            rollups = list(time_frame_2_seconds)
+        for tf in rollups:
+            if tf not in time_frame_2_seconds:
+                raise TimeFrameNotAvailable('There is no rollup level for the time frame: %s' % tf)
+        self.root = root
+        self.index_step = index_step
+        self.rollups = sorted(rollups, key=time_frame_2_seconds.get)
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        self._lock = threading.RLock()
+        self._maps: Dict = {}
+        os.makedirs(root, exist_ok=True)
+
+    def keys(self):
+        """Listing the keys of all stored series, without their rollup levels"""
+        return sorted(k for k in os.listdir(self.root)
+                      if rollup_separator not in k and os.path.exists(os.path.join(self.root, k, meta_file)))
+
+    def __contains__(self, key) -> bool:
+        return os.path.exists(os.path.join(self._path(key), meta_file))
+
+    def columns(self, key):
+        return list(self._meta(key)['columns'])
+
+    def length(self, key) -> int:
+        if key not in self:
+            return 0
+        return self._meta(key)['length']
+
+    def bounds(self, key):
+        """Returning the first and the last timestamp (ns) of a series or None when the series is empty"""
+        dt, _, _ = self._mapped(key)
+        if dt is None or len(dt) == 0:
+            return None
+        return int(dt[0]), int(dt[-1])
+
+    def write_frame(self, key, df):
+        """Writing a DataFrame indexed by datetime into a series. Every column becomes a value column"""
+        if df is None or len(df) == 0:
+            return 0
+        return self.write(key, df.index, {str(c): df[c].to_numpy(dtype=numpy.float64) for c in df.columns})
+
+    def write(self, key, timestamps, columns):
+        """Writing rows into a series
+
+        Rows that lie after the last stored timestamp are appended to the files. Otherwise the series is merged
+        with the new rows and written to new files; rows with an already stored timestamp replace the old ones.
+
+        Args:
+          key (str): the series key
+          timestamps (array-like): datetime-like values of the rows
+          columns (dict or array-like): a mapping of column name to values, or a single array of values that
+            is stored as the 'value' column
+
+        Returns:
+          int: the number of rows written
+        """
+        if not isinstance(columns, dict):
+            columns = {'value': columns}
+        dt = to_ns_array(timestamps)
+        columns = {name: numpy.asarray(values, dtype=numpy.float64) for name, values in columns.items()}
+        for name, values in columns.items():
+            if values.shape != dt.shape:
+                raise ArgumentValueError('Column %s has %d rows, expected %d' % (name, len(values), len(dt)))
+        if len(dt) == 0:
+            return 0
+
+        if rollup_separator in key:
+            raise ArgumentValueError('Series keys cannot contain %r: %s' % (rollup_separator, key))
+
+        order = numpy.argsort(dt, kind='stable')
+        if numpy.any(order[1:] < order[:-1]):
+            dt = dt[order]
+            columns = {name: values[order] for name, values in columns.items()}
+        dt, columns = self._dedupe(dt, columns)
+
+        with self._lock:
+            meta = self._write_rows(key, dt, columns)
+            self._update_rollups(key, meta, int(dt[0]), int(dt[-1]))
+            return len(dt)
+
+    def _write_rows(self, key, dt, columns):
+        """Writing sorted rows with unique timestamps into a series. Needs self._lock"""
+        path = self._path(key)
+        if key not in self:
+            os.makedirs(path, exist_ok=True)
+            meta = {'columns': sorted(columns), 'length': 0, 'index_step': self.index_step}
+            if rollup_separator not in key:
+                # levels no coarser than the spacing of the data would only copy it
+                spacing = int(numpy.median(numpy.diff(dt))) if len(dt) > 1 else 0
+                meta['rollups'] = [tf for tf in self.rollups if time_frame_2_seconds[tf] * 10 ** 9 > spacing]
+        else:
+            meta = self._meta(key)
+            if sorted(columns) != meta['columns']:
+                raise ArgumentValueError('Series %s has columns %s, got %s' % (
+                    key, meta['columns'], sorted(columns)))
+
+        last = self.bounds(key) if meta['length'] else None
+        if last is None or dt[0] > last[1]:
+            self._append(path, meta, dt, columns)
+        else:
+            self._merge(key, path, meta, dt, columns)
+        self._maps.pop(key, None)
+        return meta
+
+    def rollup(self, key, time_frame, start=None, end=None):
+        """Slicing a time window [start, end] of the time_frame level of the rollup pyramid of a series
+
+        Levels that are not kept because they are not coarser than the data are aggregated from the rows.
+
+        Returns:
+          pandas.DataFrame: '<column>.count', '<column>.min', '<column>.max', '<column>.sum' and
+          '<column>.mean' columns, indexed by the bucket start 'dt'
+        """
+        if time_frame not in time_frame_2_seconds:
+            raise TimeFrameNotAvailable('There is no rollup level for the time frame: %s' % time_frame)
+        meta = self._meta(key)
+        step = time_frame_2_seconds[time_frame] * 10 ** 9
+        rollup_key = key + rollup_separator + time_frame
+        if time_frame in meta.get('rollups', []):
+            # the buckets after the stored ones, i.e. the open one, are aggregated from the rows
+            lo = self._next_bucket(key, rollup_key, step)
+            if lo is not None and start is not None:
+                lo = max(lo, to_ns(start) // step * step)
+            parts = [self._aggregate_rows(key, lo, None, step)]
+            if rollup_key in self:
+                parts.insert(0, self.frame(rollup_key, start, end))
+            df = pandas.concat([d for d in parts if len(d)]) if any(len(d) for d in parts) else parts[-1]
+        else:
+            # whole buckets only, so the first and the last one are not cut short
+            lo = None if start is None else to_ns(start) // step * step
+            df = self._aggregate_rows(key, lo, end, step)
+        if start is not None:
+            df = df[df.index >= pandas.Timestamp(to_ns(start))]
+        if end is not None:
+            df = df[df.index <= pandas.Timestamp(to_ns(end))]
+        for name in meta['columns']:
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                df[name + '.mean'] = df[name + '.sum'] / df[name + '.count']
+        return df[sorted(df.columns)]
+
+    def _aggregate_rows(self, key, start, end, step):
+        """Aggregating the rows of [start, end] into a DataFrame of buckets of step ns"""
+        dt, columns = self.slice(key, start, end)
+        dt, stats = aggregate(dt, raw_stats(columns), step)
+        return pandas.DataFrame(data=stats, index=pandas.DatetimeIndex(dt.view('datetime64[ns]'), name='dt'))
+
+    def _next_bucket(self, key, rollup_key, step):
+        """Returning the start (ns) of the first bucket after the stored ones of a level, or None without rows"""
+        bounds = self.bounds(rollup_key) if rollup_key in self else None
+        if bounds is not None:
+            return bounds[1] + step
+        bounds = self.bounds(key)
+        return None if bounds is None else bounds[0] // step * step
+
+    def _update_rollups(self, key, meta, lo, hi):
+        """Re-aggregating the buckets of every rollup level that cover [lo, hi] (ns). Needs self._lock
+
+        Every level is aggregated from the next finer kept level, or from the rows for the finest one, so the
+        work is proportional to the written range. Buckets that the last row has closed are stored as well;
+        the open bucket is not, so appending rows appends to the levels.
+        """
+        last = self.bounds(key)[1]
+        source_key = key
+        for time_frame in meta.get('rollups', []):
+            step = time_frame_2_seconds[time_frame] * 10 ** 9
+            rollup_key = key + rollup_separator + time_frame
+            open_bucket = last // step * step
+            ranges = [(lo // step * step, min(hi // step * step + step, open_bucket) - 1),
+                      (self._next_bucket(key, rollup_key, step), open_bucket - 1)]
+            parts = []
+            for b_lo, b_hi in sorted(ranges):
+                if parts and b_lo <= parts[-1][1] + 1:
+                    parts[-1] = (parts[-1][0], max(parts[-1][1], b_hi))
+                elif b_lo <= b_hi:
+                    parts.append((b_lo, b_hi))
+            chunks = []
+            for b_lo, b_hi in parts:
+                dt, columns = self.slice(source_key, b_lo, b_hi)
+                if source_key == key:
+                    stats = raw_stats(columns)
+                else:
+                    stats = {name: numpy.asarray(values) for name, values in columns.items()}
+                chunks.append(aggregate(dt, stats, step))
+            if chunks and any(len(dt) for dt, _ in chunks):
+                dt = numpy.concatenate([dt for dt, _ in chunks])
+                stats = {name: numpy.concatenate([s[name] for _, s in chunks]) for name in chunks[0][1]}
+                self._write_rows(rollup_key, dt, stats)
+            source_key = rollup_key
+
+    def slice(self, key, start=None, end=None):
+        """Slicing a time window [start, end] of a series
+
+        Returns:
+          tuple: an int64 ns timestamp array and a dict of column name to value array.
+          Both are read-only views of the memory-mapped files.
+        """
+        dt, columns, index = self._mapped(key)
+        if dt is None:
+            return numpy.empty(0, dtype=numpy.int64), {c: numpy.empty(0) for c in self.columns(key)}
+        lo, hi = self._locate(dt, index, start, end)
+        return dt[lo:hi], {name: values[lo:hi] for name, values in columns.items()}
+
+    def frame(self, key, start=None, end=None, time_frame=None):
+        """Slicing a time window [start, end] of a series into a DataFrame indexed by 'dt'
+
+        With a time_frame, the window is served from the matching rollup level and holds the bucket means.
+        """
+        if time_frame is not None:
+            df = self.rollup(key, time_frame, start, end)
+            return df[[name + '.mean' for name in self.columns(key)]].rename(
+                columns={name + '.mean': name for name in self.columns(key)})
+        dt, columns = self.slice(key, start, end)
+        df = pandas.DataFrame(data=columns, index=pandas.DatetimeIndex(dt.view('datetime64[ns]'), name='dt'))
+        return df
+
+    def delete(self, key):
+        """Deleting a series together with its rollup levels"""
+        with self._lock:
+            for k in [key] + [key + rollup_separator + tf for tf in time_frame_2_seconds]:
+                self._maps.pop(k, None)
+                path = self._path(k)
+                if not os.path.isdir(path):
+                    continue
+                for name in os.listdir(path):
+                    os.remove(os.path.join(path, name))
+                os.rmdir(path)
+
+    def _path(self, key):
+        if not key or os.sep in key or '/' in key or key in ('.', '..'):
+            raise ArgumentValueError('Invalid series key: %r' % (key,))
+        return os.path.join(self.root, key)
+
+    def _meta(self, key):
+        if key not in self:
+            raise SeriesNotFound('The store has no such series: %s' % key)
+        with open(os.path.join(self._path(key), meta_file), 'r') as f:
+            return json.load(f)
+
+    def _write_meta(self, path, meta):
+        tmp = os.path.join(path, meta_file + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, meta_file))
+
+    def _mapped(self, key):
+        """Returning the cached memory maps of a series: (dt, {column: values}, sparse index)"""
+        with self._lock:
+            cached = self._maps.get(key)
+            if cached is not None:
+                return cached
+            meta = self._meta(key)
+            path = self._path(key)
+            n = meta['length']
+            if n == 0:
+                cached = (None, {}, None)
+            else:
+                dt = numpy.memmap(os.path.join(path, dt_file), dtype=numpy.int64, mode='r', shape=(n,))
+                columns = {name: numpy.memmap(os.path.join(path, name + column_suffix), dtype=numpy.float64,
+                                              mode='r', shape=(n,))
+                           for name in meta['columns']}
+                index = numpy.fromfile(os.path.join(path, index_file), dtype=numpy.int64)
+                cached = (dt, columns, (index, meta['index_step']))
+            self._maps[key] = cached
+            return cached
+
+    def _locate(self, dt, index, start, end):
+        sparse, step = index
+        lo = 0 if start is None else self._search(dt, sparse, step, to_ns(start), 'left')
+        hi = len(dt) if end is None else self._search(dt, sparse, step, to_ns(end), 'right')
+        return lo, max(lo, hi)
+
+    @staticmethod
+    def _search(dt, sparse, step, value, side):
+        # the sparse index narrows the search down to a single block of the mapped file
+        block = int(numpy.searchsorted(sparse, value, side=side)) - 1
+        if block < 0:
+            return 0
+        lo = block * step
+        hi = min(lo + step + 1, len(dt))
+        return lo + int(numpy.searchsorted(dt[lo:hi], value, side=side))
+
+    @staticmethod
+    def _dedupe(dt, columns):
+        """Dropping rows with repeated timestamps, keeping the last one"""
+        if len(dt) < 2:
+            return dt, columns
+        keep = numpy.append(dt[1:] != dt[:-1], True)
+        if keep.all():
+            return dt, columns
+        return dt[keep], {name: values[keep] for name, values in columns.items()}
+
+    def _append(self, path, meta, dt, columns):
+        step = meta['index_step']
+        n = meta['length']
+        with open(os.path.join(path, dt_file), 'ab') as f:
+            dt.tofile(f)
+        for name, values in columns.items():
+            with open(os.path.join(path, name + column_suffix), 'ab') as f:
+                values.tofile(f)
+        # index entries for the rows n, n + step, ... that fall into the appended part
+        first = (-n) % step
+        with open(os.path.join(path, index_file), 'ab') as f:
+            dt[first::step].tofile(f)
+        meta['length'] = n + len(dt)
+        self._write_meta(path, meta)
+
+    def _merge(self, key, path, meta, dt, columns):
+        old_dt, old_columns = self.slice(key)
+        pos = int(numpy.searchsorted(old_dt, dt[0]))
+        if numpy.isin(old_dt[pos:], dt).all():
+            # the new rows replace the tail of the series, e.g. after a chunk is fetched again
+            merged_dt = numpy.concatenate([old_dt[:pos], dt])
+            merged = {name: numpy.concatenate([old_columns[name][:pos], columns[name]]) for name in meta['columns']}
+        else:
+            merged_dt = numpy.concatenate([old_dt, dt])
+            order = numpy.argsort(merged_dt, kind='stable')
+            merged_dt = merged_dt[order]
+            merged = {name: numpy.concatenate([old_columns[name], columns[name]])[order]
+                      for name in meta['columns']}
+            merged_dt, merged = self._dedupe(merged_dt, merged)
+        self._maps.pop(key, None)
+
+        step = meta['index_step']
+        self._replace(os.path.join(path, dt_file), merged_dt)
+        for name, values in merged.items():
+            self._replace(os.path.join(path, name + column_suffix), values)
+        self._replace(os.path.join(path, index_file), merged_dt[::step])
+        meta['length'] = len(merged_dt)
+        self._write_meta(path, meta)
+
+    @staticmethod
+    def _replace(file_path, values):
+        # existing maps keep the old inode alive, so readers holding views are not affected
+        tmp = file_path + '.tmp'
+        numpy.ascontiguousarray(values).tofile(tmp)
+        os.replace(tmp, file_path)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A local stand-in for the SMDC backend, serving the login form, the query API and the metadata"""
+
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+from ngsatdata.providers.smdc import dt_format, time_frame_2_seconds
+from ngsatdata.proxy.server import ThreadingHTTPServer
+
+metadata = {
+    'data': {
+        '41105': {
+            'tags': [],
+            'instruments': {
+                'skl': {
+                    'title': 'SKL',
+                    'series': [{'avg': ['1s', '10s', '1m'], 'data': {
+                        'das3vrt1': {'name': 'das3vrt1', 'tags': []},
+                    }}],
+                },
+            },
+        },
+    },
+}
+
+
+class FakeSMDCHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=b'', cookies=None):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (cookies or {}).items():
+            self.send_header('Set-Cookie', '%s=%s; Path=/' % (name, value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cookies(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        return {name: morsel.value for name, morsel in cookie.items()}
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        server = self.server
+        if self.path.startswith('/accounts/login/'):
+            self._send(200, cookies={'csrftoken': 'token'})
+        elif self.path.startswith('/db_iface/api/v1/full/'):
+            if self._cookies().get('sessionid') not in server.sessions:
+                self._send(403)
+                return
+            with server.lock:
+                server.metadata_requests += 1
+            self._send(200, json.dumps(metadata).encode())
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        server = self.server
+        body = self._body()
+        if self.path.startswith('/accounts/login/'):
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            if form.get('username') != 'user' or form.get('password') != 'secret' or \
+                    form.get('csrfmiddlewaretoken') != 'token':
+                self._send(200)
+                return
+            sid = uuid.uuid4().hex
+            with server.lock:
+                server.logins += 1
+                server.sessions.add(sid)
+            self._send(200, cookies={'sessionid': sid})
+        elif self.path.startswith('/db_iface/api/v2/query/'):
+            if self._cookies().get('sessionid') not in server.sessions:
+                self._send(403)
+                return
+            if server.status is not None:
+                self._send(server.status)
+                return
+            with server.lock:
+                server.queries += 1
+            server.query_delay.wait(server.delay)
+            self._send(200, json.dumps(self.answer(json.loads(body))).encode())
+        else:
+            self._send(404)
+
+    def answer(self, query):
+        where = query['where']
+        start = datetime.strptime(where['min_dt'], dt_format)
+        end = datetime.strptime(where['max_dt'], dt_format)
+        step = timedelta(seconds=time_frame_2_seconds.get(where['resolution'], 1))
+        dts, values = [], []
+        cur = start
+        while cur <= end:
+            if not any(lo <= cur <= hi for lo, hi in self.server.gaps):
+                dts.append(cur.strftime(dt_format))
+                values.append((cur - datetime(1970, 1, 1)).total_seconds())
+            cur += step
+        return {'data': [{'request': name, 'result': {'code': 0}, 'response': [dts, values]}
+                         for name in query['select']]}
+
+
+class FakeSMDC(object):
+    """Running FakeSMDCHandler on a free local port in a background thread
+
+    Attributes:
+        url (str): The base URL to pass to SMDC(base_url=...).
+        gaps (list): (start, end) datetime pairs with no data.
+        delay (float): Seconds every query waits before it is answered.
+        status (int): The status every query is answered with instead of the data, e.g. 429, or None.
+    """
+
+    def __init__(self, delay=0.0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSMDCHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.sessions = set()
+        self.server.logins = 0
+        self.server.queries = 0
+        self.server.metadata_requests = 0
+        self.server.gaps = []
+        self.server.delay = delay
+        self.server.status = None
+        self.server.query_delay = threading.Event()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self.server
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def expire_sessions(self):
+        with self.server.lock:
+            self.server.sessions.clear()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import random
+import time
+
+from ngsatdata.base.coverage import CoverageIndex, add_interval, remove_interval, subtract_intervals
+
+
+class TestCoverageIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'coverage.json')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_intervals(self):
+        intervals = add_interval([[0, 10], [20, 30]], 11, 15)
+        self.assertEqual(intervals, [[0, 15], [20, 30]])
+        self.assertEqual(add_interval(intervals, 16, 19), [[0, 30]])
+        self.assertEqual(remove_interval([[0, 30]], 10, 20), [[0, 9], [21, 30]])
+        self.assertEqual(remove_interval([[0, 30]], -5, 40), [])
+
+    def test_subtract_intervals(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            intervals = [[lo, lo + rng.randint(0, 5)] for lo in sorted(rng.sample(range(0, 200, 7), 10))]
+            removed = [[lo, lo + rng.randint(0, 12)] for lo in sorted(rng.sample(range(0, 200, 13), 6))]
+            expected = set(s for lo, hi in intervals for s in range(lo, hi + 1)) - \
+                set(s for lo, hi in removed for s in range(lo, hi + 1))
+            got = subtract_intervals(intervals, removed)
+            self.assertEqual(set(s for lo, hi in got for s in range(lo, hi + 1)), expected)
+            self.assertTrue(all(a[1] < b[0] for a, b in zip(got, got[1:])))
+
+    def test_update_many_runs(self):
+        coverage = CoverageIndex()
+        present = [(10 * i, 10 * i + 5) for i in range(50000)]
+        empty = [(10 * i + 6, 10 * i + 9) for i in range(50000)]
+        started = time.monotonic()
+        coverage.update('s', present=present, empty=empty)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(len(coverage.empty('s')), 50000)
+        coverage.update('s', present=[(0, 10 ** 6)])
+        self.assertEqual(coverage.present('s'), [(datetime(1970, 1, 1), datetime(1970, 1, 12, 13, 46, 40))])
+
+    def test_latest_observation_wins(self):
+        coverage = CoverageIndex()
+        coverage.mark_empty('s', '2017-10-14 00:00:00', '2017-10-15 00:00:00')
+        coverage.mark_present('s', '2017-10-14 10:00:00', '2017-10-14 11:00:00')
+        self.assertTrue(coverage.is_empty('s', '2017-10-14 00:00:00', '2017-10-14 09:59:59'))
+        self.assertFalse(coverage.is_empty('s', '2017-10-14 00:00:00', '2017-10-14 10:00:00'))
+        self.assertEqual(coverage.present('s'), [(datetime(2017, 10, 14, 10), datetime(2017, 10, 14, 11))])
+        self.assertFalse(coverage.is_empty('other', '2017-10-14 00:00:00', '2017-10-14 09:59:59'))
+
+    def test_plan(self):
+        coverage = CoverageIndex()
+        coverage.mark_empty('s', '2017-10-14 02:00:00', '2017-10-14 03:59:59')
+        coverage.set_bounds('s', first_dt='2017-10-14 01:00:00')
+        self.assertEqual(coverage.plan('s', '2017-10-14 00:00:00', '2017-10-14 05:00:00'), [
+            (datetime(2017, 10, 14, 1), datetime(2017, 10, 14, 1, 59, 59)),
+            (datetime(2017, 10, 14, 4), datetime(2017, 10, 14, 5)),
+        ])
+        self.assertEqual(coverage.plan('s', '2017-10-14 02:00:00', '2017-10-14 03:00:00'), [])
+
+    def test_bounds_read_back(self):
+        coverage = CoverageIndex()
+        coverage.set_bounds('s', first_dt='2017-10-14 01:00:00', last_dt='2017-10-15 00:00:00')
+        coverage.mark_present('s', '2017-10-14 02:00:00', '2017-10-14 03:00:00')
+        self.assertEqual(coverage.empty('s'), [
+            (datetime.min, datetime(2017, 10, 14, 0, 59, 59)),
+            (datetime(2017, 10, 15, 0, 0, 1), datetime.max.replace(microsecond=0)),
+        ])
+        self.assertEqual(coverage.present('s'), [(datetime(2017, 10, 14, 2), datetime(2017, 10, 14, 3))])
+        coverage.forget('s', '2017-10-14 00:00:00', None)
+        self.assertEqual(coverage.empty('s'), [(datetime.min, datetime(2017, 10, 13, 23, 59, 59))])
+
+    def test_plan_min_gap(self):
+        coverage = CoverageIndex()
+        for minute in range(0, 60, 10):
+            coverage.mark_empty('s', '2017-10-14 00:%02d:00' % minute, '2017-10-14 00:%02d:05' % minute)
+        coverage.mark_empty('s', '2017-10-14 02:00:00', '2017-10-14 03:59:59')
+        self.assertEqual(coverage.plan('s', '2017-10-14 00:00:00', '2017-10-14 05:00:00',
+                                       min_gap=timedelta(hours=1)), [
+            (datetime(2017, 10, 14, 0), datetime(2017, 10, 14, 1, 59, 59)),
+            (datetime(2017, 10, 14, 4), datetime(2017, 10, 14, 5)),
+        ])
+        self.assertEqual(len(coverage.plan('s', '2017-10-14 00:00:00', '2017-10-14 01:00:00')), 6)
+
+    def test_recent_not_empty(self):
+        coverage = CoverageIndex(recent=timedelta(hours=1))
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        coverage.mark_empty('s', now - timedelta(hours=3), now)
+        self.assertTrue(coverage.is_empty('s', now - timedelta(hours=3), now - timedelta(hours=2)))
+        self.assertFalse(coverage.is_empty('s', now - timedelta(minutes=30), now))
+        coverage.update('s', empty=[(now - timedelta(minutes=10), now)])
+        self.assertEqual(coverage.empty('s'), [(now - timedelta(hours=3), now - timedelta(hours=1, seconds=1))])
+
+    def test_forget(self):
+        coverage = CoverageIndex()
+        coverage.mark_empty('s', '2017-10-14 02:00:00', '2017-10-14 03:59:59')
+        coverage.mark_empty('t', '2017-10-14 02:00:00', '2017-10-14 03:59:59')
+        coverage.forget('s', '2017-10-14 03:00:00', None)
+        self.assertEqual(coverage.empty('s'), [(datetime(2017, 10, 14, 2), datetime(2017, 10, 14, 2, 59, 59))])
+        coverage.forget()
+        self.assertEqual(coverage.keys(), [])
+
+    def test_persistence(self):
+        coverage = CoverageIndex(self.path)
+        coverage.mark_empty('s', '2017-10-14 02:00:00', '2017-10-14 03:59:59')
+        self.assertTrue(CoverageIndex(self.path).is_empty('s', '2017-10-14 02:30:00', '2017-10-14 03:00:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy
+import pandas
+
+from ngsatdata.base.downsampling import downsample, lttb_indices, minmax_indices
+from ngsatdata.providers.smdc import SMDC
+
+
+class TestDownsampling(unittest.TestCase):
+    def setUp(self) -> None:
+        index = pandas.date_range('2017-10-14 00:00:00', periods=100000, freq='1s', name='dt')
+        values = numpy.sin(numpy.arange(len(index)) / 500.0)
+        values[54321] = 10.0
+        self.df = pandas.DataFrame({'41105.skl.das3vrt1': values}, index=index)
+
+    def test_lttb_budget(self):
+        df = downsample(self.df, 2000, 'lttb')
+        self.assertEqual(len(df), 2000)
+        self.assertTrue(df.index.is_monotonic_increasing)
+        self.assertEqual(df.index[0], self.df.index[0])
+        self.assertEqual(df.index[-1], self.df.index[-1])
+        self.assertEqual(df.iloc[:, 0].max(), 10.0)
+
+    def test_minmax_budget(self):
+        for max_points in (2000, 2001):
+            df = downsample(self.df, max_points, 'minmax')
+            self.assertEqual(len(df), max_points)
+            self.assertTrue(df.index.is_unique and df.index.is_monotonic_increasing)
+            self.assertEqual(df.iloc[:, 0].max(), 10.0)
+            self.assertAlmostEqual(df.iloc[:, 0].min(), self.df.iloc[:, 0].min())
+
+    def test_constant_buckets(self):
+        indices = minmax_indices(numpy.zeros(10), 4)
+        self.assertEqual(len(numpy.unique(indices)), 4)
+        indices = lttb_indices(numpy.arange(10.0), numpy.zeros(10), 5)
+        self.assertEqual(len(numpy.unique(indices)), 5)
+
+    def test_small_frame(self):
+        df = self.df.iloc[:100]
+        self.assertIs(downsample(df, 2000), df)
+
+
+class TestSelectTimeFrame(unittest.TestCase):
+    def setUp(self) -> None:
+        self.smdc = SMDC()
+
+    def select(self, start_dt, end_dt, time_frame='auto', max_points=2000):
+        return self.smdc._select_time_frame('electro_l2', 'skl', 'das3vrt1', start_dt, end_dt, time_frame,
+                                            max_points)
+
+    def test_coarsest_time_frame(self):
+        self.assertEqual(self.select('2017-10-14 00:00:00', '2017-10-14 01:00:00'), '1s')
+        self.assertEqual(self.select('2017-10-14 00:00:00', '2017-10-15 00:00:00'), '10s')
+        self.assertEqual(self.select('2017-10-01 00:00:00', '2017-11-01 00:00:00'), '10m')
+        self.assertEqual(self.select('2010-01-01 00:00:00', '2020-01-01 00:00:00'), '6h')
+
+    def test_requested_time_frame(self):
+        self.assertEqual(self.select('2017-10-14 00:00:00', '2017-10-15 00:00:00', '1h'), '1h')
+        self.assertEqual(self.select('2017-10-14 00:00:00', '2017-10-15 00:00:00', '1s'), '10s')
+
+    def test_channel_time_frames(self):
+        self.smdc.metadata = {'data': {'electro_l2': {'instruments': {'skl': {'series': [{'avg': ['1m', '1h']}]}}}}}
+        self.assertEqual(self.select('2017-10-14 00:00:00', '2017-10-15 00:00:00'), '1m')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+
+from ngsatdata.base.errors import AuthenticationError, RequestRejected
+from ngsatdata.providers import smdc as smdc_module
+from ngsatdata.providers.smdc import SMDC
+from ngsatdata.proxy.server import ExpiringSet, ResultCache, SMDCProxy
+
+from .fake_smdc import FakeSMDC
+
+
+class TestResultCache(unittest.TestCase):
+    def test_coalescing(self):
+        cache = ResultCache()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'value', True
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(cache.get, 'key', compute) for _ in range(8)]
+            while cache.misses + cache.coalesced < 8:
+                threading.Event().wait(0.01)
+            release.set()
+            self.assertEqual([f.result() for f in futures], ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get('key', compute), 'value')
+        self.assertEqual(cache.hits, 1)
+
+    def test_errors_are_not_cached(self):
+        cache = ResultCache()
+
+        def fail():
+            raise ValueError('upstream')
+
+        with self.assertRaises(ValueError):
+            cache.get('key', fail)
+        self.assertEqual(cache.get('key', lambda: ('value', False)), 'value')
+        self.assertEqual(cache.get('key', lambda: ('other', True)), 'other')
+        self.assertEqual(len(cache), 1)
+
+    def test_lru(self):
+        cache = ResultCache(max_entries=2)
+        for key in 'abc':
+            cache.get(key, lambda: (key, True))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a', lambda: ('new', True)), 'new')
+
+
+class TestExpiringSet(unittest.TestCase):
+    def test_bounded(self):
+        members = ExpiringSet(ttl=60, max_entries=3)
+        for i in range(10):
+            members.add(i)
+        self.assertEqual(len(members), 3)
+        self.assertFalse(members.touch(0))
+        # touching a member keeps it from being dropped first
+        self.assertTrue(members.touch(7))
+        members.add(10)
+        self.assertTrue(members.touch(7))
+        self.assertFalse(members.touch(8))
+        self.assertTrue(members.pop(7))
+        self.assertFalse(members.pop(7))
+
+    def test_ttl(self):
+        members = ExpiringSet(ttl=0.05, max_entries=10)
+        members.add('a')
+        self.assertTrue(members.touch('a'))
+        time.sleep(0.1)
+        self.assertFalse(members.touch('a'))
+        self.assertEqual(len(members), 0)
+
+
+class TestSMDCProxy(unittest.TestCase):
+    """Running clients against the proxy, which runs against a local stand-in upstream"""
+
+    def setUp(self) -> None:
+        fd, self.config_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'username': 'user', 'password': 'secret'}, f)
+        patcher = mock.patch.object(smdc_module, 'config_file', self.config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake = FakeSMDC(delay=0.2)
+        self.upstream = self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__)
+        upstream_client = SMDC(base_url=self.fake.url)
+        upstream_client.authorize()
+        self.proxy = SMDCProxy(upstream_client, port=0).start()
+        self.addCleanup(self.proxy.shutdown)
+
+    def tearDown(self) -> None:
+        os.remove(self.config_path)
+
+    def client(self):
+        smdc = SMDC(base_url=self.proxy.url)
+        self.assertEqual(smdc.authorize(), True)
+        return smdc
+
+    def test_shared_queries(self):
+        clients = [self.client() for _ in range(4)]
+
+        def fetch(i):
+            return clients[i % len(clients)].fetch(source='electro_l2', instrument='skl', channel='das3vrt1',
+                                                    start_dt='2017-10-14 10:43:38',
+                                                    end_dt='2017-10-14 10:43:47',
+                                                    time_frame='1s')
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            dfs = list(executor.map(fetch, range(16)))
+        self.assertTrue(all(len(df) == 10 for df in dfs))
+        self.assertEqual(self.upstream.queries, 1)
+        self.assertEqual(self.upstream.logins, 1)
+        stats = clients[0].session.get(self.proxy.url + '/proxy/stats/').json()
+        self.assertEqual(stats['queries']['misses'], 1)
+        self.assertEqual(stats['queries']['hits'] + stats['queries']['coalesced'], 15)
+
+    def test_metadata(self):
+        for smdc in (self.client(), self.client()):
+            sources = smdc.get_sources()
+            self.assertEqual(sources[0].codename, '41105')
+        self.assertEqual(self.upstream.metadata_requests, 1)
+
+    def test_login_required(self):
+        query = json.dumps({'where': {'resolution': '1s', 'min_dt': '2017-10-14 10:43:38',
+                                      'max_dt': '2017-10-14 10:43:47'}, 'select': ['41105.skl.das3vrt1']})
+        self.assertEqual(requests.post(self.proxy.url + '/db_iface/api/v2/query/', data=query).status_code, 403)
+        self.assertEqual(requests.get(self.proxy.url + '/db_iface/api/v1/full/').status_code, 403)
+        self.assertEqual(requests.get(self.proxy.url + '/proxy/stats/',
+                                      cookies={'sessionid': 'forged'}).status_code, 403)
+        self.assertEqual(self.upstream.queries, 0)
+
+    def test_login_form_is_bounded(self):
+        proxy = SMDCProxy(self.proxy.upstream, port=0, max_sessions=5).start()
+        self.addCleanup(proxy.shutdown)
+        for _ in range(20):
+            requests.get(proxy.url + '/accounts/login/')
+        self.assertEqual(len(proxy._csrf_tokens), 5)
+
+    def test_session_expired(self):
+        proxy = SMDCProxy(self.proxy.upstream, port=0, session_ttl=0.3).start()
+        self.addCleanup(proxy.shutdown)
+        smdc = SMDC(base_url=proxy.url)
+        smdc.authorize()
+        time.sleep(0.5)
+        self.assertEqual(len(proxy.sessions), 0)
+        # the client logs in to the proxy again
+        df = smdc.fetch(source='electro_l2', instrument='skl', channel='das3vrt1',
+                        start_dt='2017-10-14 10:43:38', end_dt='2017-10-14 10:43:47', time_frame='1s')
+        self.assertEqual(len(df), 10)
+        self.assertEqual(len(proxy.sessions), 1)
+
+    def test_bad_credentials(self):
+        with open(self.config_path, 'w') as f:
+            json.dump({'username': 'user', 'password': 'wrong'}, f)
+        with self.assertRaises(AuthenticationError):
+            SMDC(base_url=self.proxy.url).authorize()
+        session = requests.Session()
+        session.get(self.proxy.url + '/accounts/login/')
+        r = session.post(self.proxy.url + '/accounts/login/',
+                         data={'username': 'user', 'password': 'secret', 'csrfmiddlewaretoken': 'guessed'})
+        self.assertNotIn('sessionid', r.cookies)
+
+    def test_invalid_query(self):
+        smdc = self.client()
+        self.upstream.status = 400
+        with self.assertRaises(RequestRejected):
+            smdc.fetch(source='electro_l2', instrument='skl', channel='das3vrt1',
+                       start_dt='2017-10-14 10:43:38', end_dt='2017-10-14 10:43:47', time_frame='1s')
+        self.assertEqual(self.upstream.logins, 1)
+
+    def test_metadata_upstream_session_expired(self):
+        smdc = self.client()
+        self.fake.expire_sessions()
+        self.assertEqual(smdc.get_sources()[0].codename, '41105')
+        self.assertEqual(self.upstream.logins, 2)
+
+    def test_upstream_session_expired(self):
+        smdc = self.client()
+        self.fake.expire_sessions()
+        df = smdc.fetch(source='electro_l2', instrument='skl', channel='das3vrt1',
+                        start_dt='2017-10-14 10:43:38', end_dt='2017-10-14 10:43:47', time_frame='1s')
+        self.assertEqual(len(df), 10)
+        self.assertEqual(self.upstream.logins, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from ngsatdata.base.errors import ArgumentValueError, DatetimeValueError, ProviderOverloaded
+from ngsatdata.base.scheduler import FetchScheduler, TokenBucket
+
+
+class TestFetchScheduler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.order = []
+        self.release = threading.Event()
+
+    def blocker(self):
+        self.release.wait(5)
+
+    def record(self, name):
+        self.order.append(name)
+        return name
+
+    def test_priority(self):
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=1) as scheduler:
+            blocked = scheduler.submit(self.blocker)
+            futures = [scheduler.submit(self.record, 'backfill%d' % i, priority='backfill') for i in range(3)]
+            futures.append(scheduler.submit(self.record, 'interactive', priority='interactive'))
+            self.release.set()
+            blocked.result()
+            for f in futures:
+                f.result(5)
+        self.assertEqual(self.order, ['interactive', 'backfill0', 'backfill1', 'backfill2'])
+
+    def test_slot_kept_for_interactive(self):
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=3) as scheduler:
+            backfills = [scheduler.submit(self.blocker, priority='backfill') for _ in range(4)]
+            # two backfills run, the third slot stays free
+            interactive = scheduler.submit(self.record, 'interactive', priority='interactive')
+            self.assertEqual(interactive.result(2), 'interactive')
+            deadline = time.monotonic() + 2
+            while scheduler.metrics()['running'] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            metrics = scheduler.metrics()
+            self.assertEqual(metrics['running'], 2)
+            self.assertEqual(metrics['backfill']['queued'], 2)
+            self.release.set()
+            for f in backfills:
+                f.result(5)
+
+    def test_fair_sharing(self):
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=1) as scheduler:
+            blocked = scheduler.submit(self.blocker, job='c')
+            futures = [scheduler.submit(self.record, 'a', job='a') for _ in range(4)]
+            futures += [scheduler.submit(self.record, 'b', job='b') for _ in range(2)]
+            self.release.set()
+            blocked.result()
+            for f in futures:
+                f.result(5)
+        self.assertEqual(self.order, ['a', 'b', 'a', 'b', 'a', 'a'])
+
+    def test_rate_limit(self):
+        with FetchScheduler(rate=20, burst=1, max_concurrency=4) as scheduler:
+            started = time.monotonic()
+            futures = [scheduler.submit(self.record, i) for i in range(6)]
+            self.assertEqual([f.result(5) for f in futures], list(range(6)))
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_back_off(self):
+        def fail():
+            raise ProviderOverloaded('429')
+
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=8, latency_target=60) as scheduler:
+            # a few throttled requests among many successful ones do not back off
+            for i in range(8):
+                scheduler.submit(self.record, i).result(5)
+            for _ in range(2):
+                with self.assertRaises(ProviderOverloaded):
+                    scheduler.submit(fail).result(5)
+            self.assertEqual(scheduler.concurrency_limit, 8)
+            # 3 of the last 11 requests reach the error rate of 0.25
+            with self.assertRaises(ProviderOverloaded):
+                scheduler.submit(fail).result(5)
+            self.assertEqual(scheduler.concurrency_limit, 4)
+            # the next back off needs a new window of outcomes
+            with self.assertRaises(ProviderOverloaded):
+                scheduler.submit(fail).result(5)
+            self.assertEqual(scheduler.concurrency_limit, 4)
+            # one more request per round of successful ones: 4 + 5 + 6 + 7 requests to get back to 8
+            for i in range(22):
+                scheduler.submit(self.record, i).result(5)
+            self.assertEqual(scheduler.concurrency_limit, 8)
+
+    def test_invalid_requests_do_not_back_off(self):
+        def invalid():
+            raise DatetimeValueError('2017-13-01')
+
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=8) as scheduler:
+            for _ in range(10):
+                with self.assertRaises(DatetimeValueError):
+                    scheduler.submit(invalid).result(5)
+            self.assertEqual(scheduler.concurrency_limit, 8)
+            metrics = scheduler.metrics()
+        self.assertEqual(metrics['normal']['failed'], 10)
+        self.assertEqual(metrics['normal']['overloaded'], 0)
+
+    def test_no_response_backs_off(self):
+        class SilentProvider(object):
+            def fetch(self, **kwargs):
+                return None
+
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=4) as scheduler:
+            futures = [scheduler.fetch(SilentProvider(), source='electro_l2') for _ in range(8)]
+            for f in futures:
+                with self.assertRaises(ProviderOverloaded):
+                    f.result(5)
+            self.assertEqual(scheduler.metrics()['normal']['overloaded'], 8)
+            self.assertLess(scheduler.concurrency_limit, 4)
+
+    def test_metrics(self):
+        with FetchScheduler(rate=1000, burst=1000, max_concurrency=2) as scheduler:
+            for i in range(5):
+                scheduler.submit(self.record, i, priority='interactive').result(5)
+            metrics = scheduler.metrics()
+        self.assertEqual(metrics['interactive']['completed'], 5)
+        self.assertEqual(metrics['backfill']['submitted'], 0)
+        self.assertGreaterEqual(metrics['interactive']['wait_p95'], 0)
+
+    def test_invalid_priority(self):
+        with FetchScheduler() as scheduler:
+            with self.assertRaises(ArgumentValueError):
+                scheduler.submit(self.record, 1, priority='urgent')
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        bucket.take()
+        bucket.take()
+        self.assertGreater(bucket.delay(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+
+import pandas
+
+from ngsatdata.base.coverage import CoverageIndex
+from ngsatdata.base.errors import ProviderOverloaded, RequestRejected
+from ngsatdata.providers import smdc as smdc_module
+from ngsatdata.providers.smdc import SMDC
+
+from .fake_smdc import FakeSMDC
+
+
+class TestSmdcClient(unittest.TestCase):
+    """Running the SMDC driver against a local stand-in backend"""
+
+    def setUp(self) -> None:
+        fd, self.config_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'username': 'user', 'password': 'secret'}, f)
+        patcher = mock.patch.object(smdc_module, 'config_file', self.config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake = FakeSMDC()
+        self.upstream = self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.smdc = SMDC(base_url=self.fake.url, pool_maxsize=4)
+        self.assertEqual(self.smdc.authorize(), True)
+
+    def tearDown(self) -> None:
+        self.smdc.close()
+        os.remove(self.config_path)
+
+    def fetch(self, minute=0):
+        return self.smdc.fetch(source='electro_l2', instrument='skl', channel='das3vrt1',
+                               start_dt='2017-10-14 10:%02d:00' % minute,
+                               end_dt='2017-10-14 10:%02d:09' % minute,
+                               time_frame='1s')
+
+    def test_instance_state(self):
+        other = SMDC(base_url='http://example.org')
+        self.assertIsNot(other.auth_input_form, self.smdc.auth_input_form)
+        self.assertIsNot(other.metadata, self.smdc.metadata)
+        self.assertIsNone(other.auth_input_form['username'])
+        self.assertEqual(other.headers['referer'], 'http://example.org/accounts/login/')
+
+    def test_shared_across_threads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            dfs = list(executor.map(self.fetch, range(40)))
+        for minute, df in enumerate(dfs):
+            self.assertIsInstance(df, pandas.DataFrame)
+            self.assertEqual(len(df), 10)
+            self.assertEqual(df.index[0], pandas.Timestamp('2017-10-14 10:%02d:00' % minute))
+        self.assertEqual(self.upstream.logins, 1)
+
+    def test_reauthorize_once(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.fetch, range(8)))
+            self.fake.expire_sessions()
+            dfs = list(executor.map(self.fetch, range(40)))
+        self.assertTrue(all(len(df) == 10 for df in dfs))
+        self.assertEqual(self.upstream.logins, 2)
+
+    def test_metadata_reauthorize(self):
+        self.fake.expire_sessions()
+        self.assertEqual(self.smdc.get_sources()[0].codename, '41105')
+        self.assertEqual(self.upstream.logins, 2)
+
+    def test_invalid_query_keeps_session(self):
+        self.upstream.status = 400
+        for _ in range(3):
+            with self.assertRaises(RequestRejected):
+                self.fetch()
+        self.assertEqual(self.upstream.logins, 1)
+
+    def test_throttled(self):
+        for status in (429, 503):
+            self.upstream.status = status
+            with self.assertRaises(ProviderOverloaded):
+                self.fetch()
+
+    def test_coverage(self):
+        self.upstream.gaps = [(datetime(2017, 10, 14, 12, 0, 0), datetime(2017, 10, 14, 14, 0, 0))]
+        self.smdc.coverage = CoverageIndex()
+        fetch = dict(source='electro_l2', instrument='skl', channel='das3vrt1', time_frame='1m')
+        df = self.smdc.fetch(start_dt='2017-10-14 12:30:00', end_dt='2017-10-14 13:30:00', **fetch)
+        self.assertEqual(len(df), 0)
+        df = self.smdc.fetch(start_dt='2017-10-14 11:00:00', end_dt='2017-10-14 15:00:00', **fetch)
+        self.assertEqual(len(df), 120)
+        queries = self.upstream.queries
+        df = self.smdc.fetch(start_dt='2017-10-14 12:01:00', end_dt='2017-10-14 13:59:00', **fetch)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(self.upstream.queries, queries)
+        df = self.smdc.fetch(start_dt='2017-10-14 12:01:00', end_dt='2017-10-14 13:59:00', use_coverage=False,
+                             **fetch)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(self.upstream.queries, queries + 1)
+        key = self.smdc.coverage_key('electro_l2', 'skl', 'das3vrt1', '1m')
+        self.assertEqual(self.smdc.coverage.plan(key, '2017-10-14 11:00:00', '2017-10-14 15:00:00'), [
+            (datetime(2017, 10, 14, 11, 0, 0), datetime(2017, 10, 14, 11, 59, 59)),
+            (datetime(2017, 10, 14, 14, 0, 1), datetime(2017, 10, 14, 15, 0, 0)),
+        ])
+        # the 1s series of the channel has not been seen yet
+        key = self.smdc.coverage_key('electro_l2', 'skl', 'das3vrt1', '1s')
+        self.assertFalse(self.smdc.coverage.is_empty(key, '2017-10-14 12:01:00', '2017-10-14 13:59:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+
+import numpy
+import pandas
+
+from ngsatdata.base.errors import SeriesNotFound
+from ngsatdata.store.loader import SMDCLoader, series_key
+from ngsatdata.store.mmapstore import MmapStore
+
+
+class FakeProvider(object):
+    """Serving a 1s ramp like SMDC.fetch does"""
+
+    def __init__(self):
+        self.calls = []
+
+    def fetch(self, source, instrument, channel, start_dt, end_dt, time_frame, level='default'):
+        self.calls.append((start_dt, end_dt))
+        index = pandas.date_range(start_dt, end_dt, freq='1s', name='dt')
+        seconds = (index - pandas.Timestamp(0)) // pandas.Timedelta('1s')
+        return pandas.DataFrame({'41105.skl.' + channel: seconds}, index=index)
+
+
+class TestMmapStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.store = MmapStore(self.root, index_step=16)
+        self.index = pandas.date_range('2017-10-14 00:00:00', periods=1000, freq='1s')
+        self.values = numpy.arange(1000, dtype=numpy.float64)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_slice(self):
+        self.store.write('s', self.index, self.values)
+        dt, columns = self.store.slice('s', '2017-10-14 00:01:00', '2017-10-14 00:01:09')
+        self.assertEqual(len(dt), 10)
+        self.assertEqual(list(columns['value']), list(range(60, 70)))
+        self.assertIsInstance(columns['value'].base, numpy.memmap)
+
+    def test_slice_bounds(self):
+        self.store.write('s', self.index, self.values)
+        dt, _ = self.store.slice('s', '2017-10-13 00:00:00', '2017-10-15 00:00:00')
+        self.assertEqual(len(dt), 1000)
+        dt, _ = self.store.slice('s', '2017-10-15 00:00:00', '2017-10-16 00:00:00')
+        self.assertEqual(len(dt), 0)
+        for start in range(0, 1000, 7):
+            dt, _ = self.store.slice('s', self.index[start], self.index[start] + timedelta(seconds=20))
+            self.assertEqual(len(dt), min(21, 1000 - start))
+            self.assertEqual(dt[0], self.index[start].value)
+
+    def test_append_and_merge(self):
+        self.store.write('s', self.index[:500], self.values[:500])
+        self.store.write('s', self.index[500:], self.values[500:])
+        self.store.write('s', self.index[::10], -self.values[::10])
+        df = self.store.frame('s')
+        self.assertEqual(len(df), 1000)
+        self.assertTrue(df.index.is_monotonic_increasing)
+        self.assertEqual(df['value'].iloc[10], -10)
+        self.assertEqual(df['value'].iloc[11], 11)
+        self.assertEqual(self.store.slice('s', self.index[995], None)[1]['value'][-1], 999)
+
+    def test_overwrite_tail(self):
+        self.store.write('s', self.index[:500], self.values[:500])
+        dt, columns = self.store.slice('s')
+        before = numpy.array(dt)
+        self.store.write('s', self.index[450:], -self.values[450:])
+        df = self.store.frame('s')
+        self.assertEqual(len(df), 1000)
+        self.assertEqual(df['value'].iloc[449], 449)
+        self.assertEqual(df['value'].iloc[450], -450)
+        self.assertEqual(len(self.store.slice('s', self.index[600], self.index[615])[0]), 16)
+        # views taken before the write keep their values
+        self.assertEqual(len(dt), 500)
+        self.assertTrue(numpy.array_equal(dt, before))
+        self.assertTrue(numpy.array_equal(columns['value'], self.values[:500]))
+
+    def test_views_survive_rollup_writes(self):
+        self.store.write('s', self.index[:500], self.values[:500])
+        dt, columns = self.store.slice('s@1m')
+        expected = numpy.array(columns['value.sum'])
+        self.store.write('s', self.index[500:], self.values[500:])
+        self.store.write('s', self.index[100:200], -self.values[100:200])
+        self.assertTrue(numpy.array_equal(columns['value.sum'], expected))
+        self.assertEqual(self.store.length('s@1m'), 16)
+
+    def test_missing_series(self):
+        with self.assertRaises(SeriesNotFound):
+            self.store.slice('missing')
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.store = MmapStore(self.root, index_step=64)
+        self.index = pandas.date_range('2017-10-14 00:00:00', periods=3 * 3600, freq='1s')
+        self.values = numpy.random.RandomState(0).normal(size=len(self.index))
+        self.values[100:200] = numpy.nan
+        self.expected = pandas.Series(self.values, index=self.index)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def check(self, key, time_frame, freq):
+        df = self.store.rollup(key, time_frame)
+        resampled = self.expected.resample(freq)
+        self.assertTrue(numpy.allclose(df['value.count'], resampled.count()))
+        self.assertTrue(numpy.allclose(df['value.min'], resampled.min(), equal_nan=True))
+        self.assertTrue(numpy.allclose(df['value.max'], resampled.max(), equal_nan=True))
+        self.assertTrue(numpy.allclose(df['value.mean'], resampled.mean(), equal_nan=True))
+
+    def test_incremental(self):
+        # in order, overlapping the previous chunk, and out of order
+        for lo, hi in [(0, 4000), (3990, 7000), (9000, 10800), (7000, 9000)]:
+            self.store.write('s', self.index[lo:hi], self.values[lo:hi])
+        self.assertEqual(self.store.keys(), ['s'])
+        # the bucket of the last row stays open and is aggregated at query time
+        self.assertEqual(self.store.length('s@1m'), 179)
+        self.assertEqual(self.store.length('s@6h'), 0)
+        for time_frame, freq in [('10s', '10s'), ('1m', '1min'), ('5m', '5min'), ('1h', '1h'), ('6h', '6h')]:
+            self.check('s', time_frame, freq)
+
+    def test_levels_not_coarser_than_data(self):
+        minutes = self.expected.resample('1min').mean()
+        self.store.write('m', minutes.index, minutes.to_numpy())
+        self.assertNotIn('m@1m', self.store)
+        self.assertIn('m@5m', self.store)
+        df = self.store.rollup('m', '1m', '2017-10-14 01:00:00', '2017-10-14 01:09:59')
+        self.assertEqual(len(df), 10)
+        self.assertTrue(numpy.allclose(df['value.mean'], minutes['2017-10-14 01:00:00':'2017-10-14 01:09:59']))
+
+    def test_frame_time_frame(self):
+        self.store.write('s', self.index, self.values)
+        df = self.store.frame('s', '2017-10-14 01:00:00', '2017-10-14 02:59:59', time_frame='1h')
+        self.assertEqual(list(df.columns), ['value'])
+        self.assertEqual(len(df), 2)
+        self.assertAlmostEqual(df['value'].iloc[0], self.expected['2017-10-14 01:00:00':'2017-10-14 01:59:59'].mean())
+
+    def test_delete(self):
+        self.store.write('s', self.index, self.values)
+        self.store.delete('s')
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class TestSMDCLoader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_load(self):
+        provider = FakeProvider()
+        loader = SMDCLoader(provider, MmapStore(self.root), chunk=timedelta(minutes=10))
+        key = loader.load(source='electro_l2', instrument='skl', channel='das3vrt1',
+                          start_dt='2017-10-14 10:00:00', end_dt='2017-10-14 10:59:59', time_frame='1s')
+        self.assertEqual(key, series_key('electro_l2', 'skl', 'das3vrt1', '1s'))
+        self.assertEqual(len(provider.calls), 6)
+        df = loader.store.frame(key, '2017-10-14 10:43:38', '2017-10-14 10:43:47')
+        self.assertEqual(list(df.columns), ['das3vrt1'])
+        self.assertEqual(len(df), 10)
+        self.assertEqual(df.index[0], pandas.Timestamp('2017-10-14 10:43:38'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import numpy
+
+from ngsatdata.ml.windows import RunningStats, WindowedBatchLoader
+from ngsatdata.store.mmapstore import MmapStore
+
+from .test_store import FakeProvider
+
+
+class TestWindowedBatchLoader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def loader(self, **kwargs):
+        params = dict(channels=[('electro_l2', 'skl', 'das3vrt1'), {'source': 'electro_l2',
+                                                                    'instrument': 'skl',
+                                                                    'channel': 'das3vrt2'}],
+                      start_dt='2017-10-14 10:00:00',
+                      end_dt='2017-10-14 10:09:59',
+                      time_frame='1s',
+                      window=20,
+                      stride=7,
+                      batch_size=16,
+                      provider=FakeProvider(),
+                      chunk=timedelta(minutes=1))
+        params.update(kwargs)
+        return WindowedBatchLoader(**params)
+
+    def test_batches(self):
+        loader = self.loader(normalize=False, dtype=numpy.float64)
+        batches = list(loader)
+        windows = numpy.concatenate(batches)
+        self.assertEqual(batches[0].shape, (16, 20, 2))
+        self.assertEqual(len(windows), (600 - 20) // 7 + 1)
+        # windows are contiguous across chunk boundaries
+        start = windows[:, 0, 0]
+        self.assertTrue(numpy.all(numpy.diff(start) == 7))
+        self.assertTrue(numpy.all(numpy.diff(windows[:, :, 0], axis=1) == 1))
+
+    def test_stride_longer_than_window(self):
+        loader = self.loader(normalize=False, dtype=numpy.float64, window=5, stride=25,
+                             chunk=timedelta(seconds=36))
+        windows = numpy.concatenate(list(loader))
+        self.assertEqual(len(windows), (600 - 5) // 25 + 1)
+        self.assertTrue(numpy.all(numpy.diff(windows[:, 0, 0]) == 25))
+
+    def test_normalization(self):
+        loader = self.loader()
+        mean, std = loader.compute_stats()
+        values = numpy.arange(600, dtype=numpy.float64) + 1507975200
+        self.assertTrue(numpy.allclose(mean, values.mean()))
+        self.assertTrue(numpy.allclose(std, values.std()))
+        windows = numpy.concatenate(list(loader))
+        self.assertLess(abs(windows.mean()), 0.1)
+
+    def test_single_download(self):
+        provider = FakeProvider()
+        loader = self.loader(provider=provider)
+        list(loader)
+        self.assertEqual(len(provider.calls), 2 * len(loader.chunks))
+        provider = FakeProvider()
+        list(self.loader(provider=provider, mean=[0, 0], std=[1, 1]))
+        self.assertEqual(len(provider.calls), 2 * len(loader.chunks))
+
+    def test_store_cache(self):
+        store = MmapStore(self.root)
+        list(self.loader(store=store, normalize=False))
+        cached = list(self.loader(store=store, provider=None, normalize=False))
+        self.assertEqual(sum(len(b) for b in cached), (600 - 20) // 7 + 1)
+
+    def test_store_writes_in_order(self):
+        class SlowProvider(FakeProvider):
+            # the chunks of even minutes take longer, so the read-ahead finishes them out of order
+            def fetch(self, start_dt, **kwargs):
+                time.sleep(0.05 if int(start_dt[14:16]) % 2 == 0 else 0)
+                return super().fetch(start_dt=start_dt, **kwargs)
+
+        store = MmapStore(self.root)
+        with mock.patch.object(MmapStore, '_merge', autospec=True, side_effect=MmapStore._merge) as merge:
+            list(self.loader(store=store, provider=SlowProvider(), normalize=False, workers=4))
+        self.assertEqual(merge.call_count, 0)
+        self.assertEqual(store.length('electro_l2.skl.das3vrt1.1s'), 600)
+
+    def test_running_stats(self):
+        values = numpy.random.RandomState(0).normal(size=(1000, 3))
+        values[::5, 1] = numpy.nan
+        stats = RunningStats(3)
+        for part in numpy.array_split(values, 7):
+            stats.update(part)
+        self.assertTrue(numpy.allclose(stats.mean, numpy.nanmean(values, axis=0)))
+        self.assertTrue(numpy.allclose(stats.std, numpy.nanstd(values, axis=0)))
+
+
+if __name__ == '__main__':
+    unittest.main()